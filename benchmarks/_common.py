@@ -0,0 +1,38 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+### Benchmark helpers: each configuration runs in its own process, so peak memory is not shared with other runs
+
+def peak_memory_mb(device=None):
+    """Peak allocated memory of a CUDA device, or peak RSS of this process."""
+    if device is not None and device.type == 'cuda':
+        import torch
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def add_worker_argument(parser):
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+
+def run_if_worker(args, run, **kwargs):
+    """In a child started by run_worker: runs the configuration given by --worker, prints its result and exits."""
+    if args.worker is None:
+        return
+    print(json.dumps(run(**json.loads(args.worker), **kwargs)))
+    sys.exit(0)
+
+def run_worker(module, config, *args):
+    """
+    Runs `python -m module *args --worker config` in a child process.
+    :return: Dict returned by the child's run function.
+    :raises RuntimeError: With the last line of the child's stderr when it fails.
+    """
+    result = subprocess.run([sys.executable, "-m", module, *args, "--worker", json.dumps(config)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"exit code {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
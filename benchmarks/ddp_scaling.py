@@ -0,0 +1,68 @@
+import argparse
+import contextlib
+import io
+import os
+import time
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from configs.config import Config
+from benchmarks.train_memory import SyntheticDataset
+from utils.samplers import ResumableDistributedSampler
+
+### Training throughput of train() with DistributedDataParallel on 1, 2, 4 CPU processes of this machine
+
+def worker(rank, world_size, args, results):
+    from transformers import get_linear_schedule_with_warmup
+    from model.vqa_model import VQAModel
+    from train import train
+
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(args.port)
+    # Processes share the cores instead of each using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    torch.manual_seed(Config.SEED)
+    model = VQAModel()
+    if world_size > 1:
+        model = nn.parallel.DistributedDataParallel(model)
+    optimizer = optim.AdamW(model.parameters(), Config.lr)
+    criterion = nn.CrossEntropyLoss(ignore_index=1)
+
+    def train_steps(num_steps):
+        # Fixed batch per process, so the global batch grows with the number of processes
+        dataset = SyntheticDataset(num_steps * args.batch_size * world_size)
+        loader = DataLoader(dataset, batch_size=args.batch_size, sampler=ResumableDistributedSampler(dataset))
+        scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_steps)
+        with contextlib.redirect_stdout(io.StringIO()):
+            train(model, loader, 1, optimizer, scheduler, criterion, None, torch.device('cpu'))
+
+    train_steps(1)
+    dist.barrier()
+    start = time.perf_counter()
+    train_steps(args.steps)
+    dist.barrier()
+    if rank == 0:
+        results[world_size] = args.steps * args.batch_size * world_size / (time.perf_counter() - start)
+    dist.destroy_process_group()
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=4, help="Batch size of each process")
+    parser.add_argument("--steps", type=int, default=5, help="Optimizer steps timed per world size")
+    parser.add_argument("--world_sizes", type=str, default="1,2,4")
+    parser.add_argument("--port", type=int, default=29511)
+    args = parser.parse_args()
+
+    results = mp.Manager().dict()
+    for world_size in [int(size) for size in args.world_sizes.split(",")]:
+        mp.spawn(worker, args=(world_size, args, results), nprocs=world_size, join=True)
+        args.port += 1
+        speed = results[world_size]
+        base = results.get(1, speed)
+        print(f"{world_size} process(es): {speed:7.2f} samples/sec  speedup {speed / base:5.2f}x  "
+              f"efficiency {speed / base / world_size:6.1%}")
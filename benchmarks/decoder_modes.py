@@ -0,0 +1,57 @@
+import argparse
+import time
+import torch
+from model.decoder_model import Decoder, set_fused
+from model.execution import autocast
+from configs.config import Config
+
+### Decoder.forward at training shapes (batch x 38 x 768, 4 layers) in each execution mode
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+# name, fused kernels, precision, torch.compile, tolerance against the reference mode
+MODES = [
+    ('reference fp32', False, 'fp32', False, 0.0),
+    ('fused fp32', True, 'fp32', False, 1e-4),
+    ('reference bf16', False, 'bf16', False, 1e-1),
+    ('fused bf16', True, 'bf16', False, 1e-1),
+    ('fused fp32 + compile', True, 'fp32', True, 1e-4),
+]
+
+def time_forward(decoder, x, y, mask, precision, repeats):
+    with torch.no_grad(), autocast(precision):
+        out = decoder(x, y, mask, cross_mask=mask)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            decoder(x, y, mask, cross_mask=mask)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+    return out.float(), (time.perf_counter() - start) / repeats * 1000
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    torch.manual_seed(Config.SEED)
+    length = Config.MAX_LEN_ANS
+    reference = Decoder(768, 2048, 4, 0.1, num_layers=4).to(device).eval()
+    x = torch.randn(args.batch_size, length, 768, device=device)
+    y = torch.randn(args.batch_size, length, 768, device=device)
+    mask = torch.triu(torch.full([length, length], float('-inf')), diagonal=1).to(device)
+
+    reference_out, reference_ms = None, None
+    for name, fused, precision, compile, tolerance in MODES:
+        decoder = Decoder(768, 2048, 4, 0.1, num_layers=4).to(device).eval()
+        decoder.load_state_dict(reference.state_dict())
+        set_fused(decoder, fused)
+        if compile:
+            decoder.compile()
+        out, ms = time_forward(decoder, x, y, mask, precision, args.repeats)
+        if reference_out is None:
+            reference_out, reference_ms = out, ms
+        error = (out - reference_out).abs().max().item()
+        status = "ok" if error <= tolerance else "FAILED"
+        print(f"{name:22s} {ms:8.2f} ms  speedup {reference_ms / ms:5.2f}x  "
+              f"max abs error {error:.2e} (tolerance {tolerance:.0e}) {status}")
@@ -0,0 +1,100 @@
+import argparse
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.flop_counter import FlopCounterMode
+from configs.config import Config
+from model.decoder_model import Decoder
+from model.vqa_model import causal_mask
+from utils.samplers import LengthBucketBatchSampler
+
+### Decoder + output head FLOPs and time per epoch: answers padded to MAX_LEN_ANS, to the longest
+### answer of random batches, and to the longest answer of length-bucketed batches
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+def answer_lengths(csv_path, num_samples):
+    if csv_path is None:
+        # Mostly short answers with a long tail, roughly like ViTextVQA
+        rng = np.random.default_rng(Config.SEED)
+        return np.clip(rng.geometric(0.15, num_samples) + 2, 3, Config.MAX_LEN_ANS)
+    from utils.data_processing import read_annotations
+    from utils.ViTextVQA_dataset import PAD_ID, tokenize_answers
+    return (tokenize_answers(read_annotations(csv_path, columns=['answer'])['answer']) != PAD_ID).sum(axis=1)
+
+def batch_lengths(lengths, batch_size, pool_size):
+    """Padded answer length of every batch of one epoch, for each padding scheme."""
+    order = np.random.default_rng(Config.SEED).permutation(len(lengths))
+    random_batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    sampler = LengthBucketBatchSampler(lengths, batch_size, pool_size=pool_size, num_replicas=1, rank=0)
+    return {
+        'fixed': [Config.MAX_LEN_ANS] * len(random_batches),
+        'dynamic': [int(lengths[batch].max()) for batch in random_batches],
+        'bucketed': [int(lengths[batch].max()) for batch in sampler],
+    }
+
+class DecoderHead(nn.Module):
+    """The decoder and output head of VQAModel, fed with random answer embeddings and context."""
+
+    def __init__(self, vocab_size):
+        super().__init__()
+        self.decoder = Decoder(768, 2048, 4, 0.1, 4)
+        self.mlp = nn.Sequential(nn.Dropout(p=0.3), nn.Linear(768, 768), nn.GELU(), nn.Linear(768, vocab_size))
+
+    def forward(self, x, context):
+        y = context.unsqueeze(1).expand(-1, x.size(1), -1)
+        mask = causal_mask(x.size(1))
+        return self.mlp(self.decoder(x, y, mask, cross_mask=mask))
+
+def train_step(model, batch_size, length):
+    x = torch.randn(batch_size, length, 768, device=device)
+    context = torch.randn(batch_size, 768, device=device)
+    model(x, context).float().mean().backward()
+
+def step_flops(model, batch_size, length):
+    with FlopCounterMode(display=False) as counter:
+        train_step(model, batch_size, length)
+    return counter.get_total_flops()
+
+def step_ms(model, batch_size, length, repeats):
+    train_step(model, batch_size, length)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        train_step(model, batch_size, length)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train_csv_path", type=str, default=None, help="Training CSV or Parquet file to take the answer lengths from")
+    parser.add_argument("--num_samples", type=int, default=20000, help="Synthetic answers when no CSV is given")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--pool_size", type=int, default=100, help="Batches per length-sorted pool")
+    parser.add_argument("--vocab_size", type=int, default=64001)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    torch.manual_seed(Config.SEED)
+    lengths = answer_lengths(args.train_csv_path, args.num_samples)
+    schemes = batch_lengths(lengths, args.batch_size, args.pool_size)
+    model = DecoderHead(args.vocab_size).to(device).train()
+
+    # Every batch of a given length costs the same, so each length is measured once
+    used = sorted(set(length for batch in schemes.values() for length in batch))
+    flops = {length: step_flops(model, args.batch_size, length) for length in used}
+    ms = {length: step_ms(model, args.batch_size, length, args.repeats) for length in used}
+
+    print(f"{len(lengths)} answers, mean length {lengths.mean():.1f} tokens, batch {args.batch_size} on {device.type}")
+    reference = None
+    for name, batches in schemes.items():
+        epoch_flops = sum(flops[length] for length in batches)
+        epoch_s = sum(ms[length] for length in batches) / 1000
+        padding = 1 - lengths.sum() / (sum(batches) * args.batch_size)
+        reference = reference or (epoch_flops, epoch_s)
+        print(f"{name:9s} mean padded length {np.mean(batches):5.1f}  padding {padding:6.1%}  "
+              f"decoder+head {epoch_flops / 1e15:8.3f} PFLOP/epoch ({reference[0] / epoch_flops:5.2f}x fewer)  "
+              f"{epoch_s:8.1f} s/epoch ({reference[1] / epoch_s:5.2f}x faster)")
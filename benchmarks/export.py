@@ -0,0 +1,40 @@
+import os
+import time
+import torch
+from configs.arg_parser import get_args
+from configs.config import Config
+from model.inference import load_vqa_model
+from model.export import check_parity
+from model.exported import ExportedVQAModel
+from utils.ViTextVQA_dataset import tokenize_questions
+
+### Latency of eager VQAModel.generate vs the exported graphs at batch sizes 1, 8 and 32
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+def latency_ms(model, images, ques_ids, ques_mask, repeats):
+    model.generate(images, ques_ids, ques_mask)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.generate(images, ques_ids, ques_mask)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__=="__main__":
+    args = get_args()
+    torch.manual_seed(Config.SEED)
+    model = load_vqa_model(os.path.join(args.model_path, 'vi_text.pt'), fused=args.fused)
+    exported = ExportedVQAModel(args.export_dir or os.path.join(args.model_path, 'exported'))
+
+    for batch_size in (1, 8, 32):
+        parity = check_parity(model, exported, batch_size)
+        images = torch.randint(0, 256, (batch_size, 3, 224, 224), dtype=torch.uint8, device=device)
+        ques_ids, ques_mask = tokenize_questions(["biển số xe là gì?"] * batch_size)
+        ques_ids, ques_mask = torch.from_numpy(ques_ids), torch.from_numpy(ques_mask)
+        with torch.no_grad():
+            eager_ms = latency_ms(model, images, ques_ids, ques_mask, repeats=3)
+            exported_ms = latency_ms(exported, images, ques_ids, ques_mask, repeats=3)
+        print(f"batch {batch_size:2d}: eager {eager_ms:8.1f} ms, exported {exported_ms:8.1f} ms, "
+              f"speedup {eager_ms / exported_ms:5.2f}x, log-probs max abs diff {parity['log_probs_diff']:.2e}, "
+              f"same tokens: {parity['same_tokens']}")
@@ -0,0 +1,39 @@
+import time
+import torch
+from configs.arg_parser import get_args
+from configs.config import Config
+from model.vqa_model import VQAModel
+from utils.ViTextVQA_dataset import tokenize_questions
+
+### Tokens/sec of VQAModel.generate with and without the decoder KV cache
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+def benchmark(model, context, use_cache, num_beams, repeats=3):
+    tokens = model.generate_from_context(context, num_beams=num_beams, use_cache=use_cache)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        tokens = model.generate_from_context(context, num_beams=num_beams, use_cache=use_cache)
+    elapsed = (time.perf_counter() - start) / repeats
+    # Every step produces one token per sample, including <pad> after </s>
+    num_tokens = (tokens.size(1) - 1) * tokens.size(0)
+    return tokens, num_tokens / elapsed
+
+if __name__=="__main__":
+    args = get_args()
+    torch.manual_seed(Config.SEED)
+    model = VQAModel().to(device)
+    model.eval()
+
+    images = torch.randint(0, 256, (args.batch_size, 3, 224, 224), dtype=torch.uint8)
+    ques_ids, ques_mask = tokenize_questions(["biển số xe là gì?"] * args.batch_size)
+    with torch.no_grad():
+        context = model.encode(images, torch.from_numpy(ques_ids), torch.from_numpy(ques_mask))
+
+    for num_beams in (1, 3):
+        no_cache_tokens, no_cache_speed = benchmark(model, context, use_cache=False, num_beams=num_beams)
+        cache_tokens, cache_speed = benchmark(model, context, use_cache=True, num_beams=num_beams)
+        same = torch.equal(no_cache_tokens, cache_tokens)
+        print(f"num_beams={num_beams} length={cache_tokens.size(1)} "
+              f"no cache: {no_cache_speed:.1f} tokens/sec, cache: {cache_speed:.1f} tokens/sec, "
+              f"speedup: {cache_speed / no_cache_speed:.2f}x, same output: {same}")
@@ -0,0 +1,79 @@
+import argparse
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from configs.config import Config
+
+### Images/sec and questions/sec of a training step with one image per question against
+### grouped batches that encode each image once (--group_by_image)
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+def make_batch(batch_size, questions_per_image):
+    from utils.ViTextVQA_dataset import tokenize_questions, tokenize_answers
+    num_images = -(-batch_size // questions_per_image)
+    images = torch.randint(0, 256, (num_images, 3, 224, 224), dtype=torch.uint8)
+    image_index = torch.arange(batch_size) // questions_per_image
+    questions = ["biển số xe là gì?", "tên cửa hàng là gì?", "có bao nhiêu người?"]
+    ques_ids, ques_mask = tokenize_questions([questions[i % len(questions)] for i in range(batch_size)])
+    ans_ids = tokenize_answers(["51f 123.45"] * batch_size)
+    return images, image_index, torch.from_numpy(ques_ids), torch.from_numpy(ques_mask), torch.from_numpy(ans_ids)
+
+def train_step(model, optimizer, criterion, batch, grouped):
+    images, image_index, ques_ids, ques_mask, ans_ids = batch
+    if grouped:
+        outputs, targets = model(images, ques_ids, ques_mask, ans_ids, None, mode='train', mask=True,
+                                 image_index=image_index)
+    else:
+        # The per-pair path: every question carries its own copy of the image
+        outputs, targets = model(images[image_index], ques_ids, ques_mask, ans_ids, None, mode='train', mask=True)
+    loss = criterion(outputs[:, :-1].permute(0, 2, 1), targets[:, 1:].long())
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+def time_steps(model, optimizer, criterion, batch, grouped, steps):
+    train_step(model, optimizer, criterion, batch, grouped)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step(model, optimizer, criterion, batch, grouped)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
+@torch.no_grad()
+def max_difference(model, batch):
+    """Largest difference between the eval-mode logits of both paths, should be at rounding level."""
+    images, image_index, ques_ids, ques_mask, ans_ids = batch
+    model.eval()
+    grouped, _ = model(images, ques_ids, ques_mask, ans_ids, None, mode='train', mask=True, image_index=image_index)
+    per_pair, _ = model(images[image_index], ques_ids, ques_mask, ans_ids, None, mode='train', mask=True)
+    model.train()
+    return (grouped - per_pair).abs().max().item()
+
+if __name__=="__main__":
+    from model.vqa_model import VQAModel
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--questions_per_image", type=str, default="1,2,4,8", help="Questions sharing each image")
+    parser.add_argument("--steps", type=int, default=3, help="Training steps timed per configuration")
+    args = parser.parse_args()
+
+    torch.manual_seed(Config.SEED)
+    model = VQAModel().to(device).train()
+    optimizer = optim.AdamW([param for param in model.parameters() if param.requires_grad], Config.lr)
+    criterion = nn.CrossEntropyLoss(ignore_index=1)
+
+    print(f"batch of {args.batch_size} questions on {device.type}")
+    for questions_per_image in [int(k) for k in args.questions_per_image.split(",")]:
+        batch = make_batch(args.batch_size, questions_per_image)
+        num_images = batch[0].size(0)
+        for name, grouped in (('per pair', False), ('grouped', True)):
+            seconds = time_steps(model, optimizer, criterion, batch, grouped, args.steps)
+            print(f"{questions_per_image:2d} questions/image {name:8s} {num_images / seconds:8.2f} images/sec  "
+                  f"{args.batch_size / seconds:8.2f} questions/sec")
+        print(f"{questions_per_image:2d} questions/image max logit difference {max_difference(model, batch):.1e}")
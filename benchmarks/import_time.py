@@ -0,0 +1,47 @@
+import argparse
+import subprocess
+import sys
+import os
+
+### Import time of the modules a worker or test harness loads, guarded by a budget
+
+MODULES = ['model.vqa_model', 'model.backbones', 'utils.ViTextVQA_dataset', 'utils.metrics',
+           'utils.mmap_store', 'configs.config']
+# Heavy packages that must only be loaded on first use
+LAZY_PACKAGES = ['transformers.models', 'underthesea', 'matplotlib', 'torchvision', 'pandas']
+
+def measure(modules):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # The unknown flag makes the import fail if any module parses sys.argv
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules),
+                             '--not-an-argument'], cwd=root, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return timings
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget_ms", type=float, default=1000, help="Maximum total import time")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to print")
+    args = parser.parse_args()
+
+    timings = measure(MODULES)
+    total_ms = sum(self_us for _, self_us, _ in timings) / 1000
+    for name, _, cumulative_us in sorted(timings, key=lambda t: -t[2])[:args.top]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name}")
+
+    loaded = [name.strip() for name, _, _ in timings]
+    eager = sorted({package for package in LAZY_PACKAGES
+                    if any(name == package or name.startswith(package + '.') for name in loaded)})
+    print(f"Total import time: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    if eager:
+        print(f"Imported eagerly: {', '.join(eager)}")
+    if total_ms > args.budget_ms or eager:
+        sys.exit(1)
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from benchmarks._common import add_worker_argument, peak_memory_mb, run_if_worker, run_worker
+from utils.json_to_parquet import convert_file
+
+### Peak memory and rows/sec of utils/json_to_parquet.py against json.load, for growing annotation files
+
+def write_annotations(path, num_rows):
+    # Written one annotation at a time, like ViTextVQA files with an "images" array first
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"images": [], "annotations": [')
+        for i in range(num_rows):
+            anno = {"id": i, "image_id": i // 5, "question": f"biển số xe thứ {i} là gì?",
+                    "answers": [f"câu trả lời {i}", "51g 123.45"]}
+            file.write(("," if i else "") + json.dumps(anno, ensure_ascii=False))
+        file.write(']}')
+
+def run(json_path, method):
+    start = time.perf_counter()
+    if method == 'stream':
+        num_rows = convert_file(json_path, json_path + '.parquet')
+    else:
+        with open(json_path, 'r', encoding='utf-8') as file:
+            num_rows = len(json.load(file)['annotations'])
+    return {'rows': num_rows, 'seconds': time.perf_counter() - start, 'peak_mb': peak_memory_mb()}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000", help="Annotations per generated file")
+    add_worker_argument(parser)
+    args = parser.parse_args()
+    run_if_worker(args, run)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            json_path = os.path.join(tmp_dir, f"annotations_{size}.json")
+            write_annotations(json_path, size)
+            file_mb = os.path.getsize(json_path) / 2 ** 20
+            for method in ('json.load', 'stream'):
+                try:
+                    stats = run_worker("benchmarks.json_convert", {'json_path': json_path, 'method': method})
+                except RuntimeError as e:
+                    print(f"{size:8d} rows {method:9s} FAILED: {e}")
+                    continue
+                print(f"{size:8d} rows ({file_mb:7.1f} MB) {method:9s} peak {stats['peak_mb']:8.1f} MB  "
+                      f"{stats['rows'] / stats['seconds']:10.0f} rows/sec")
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import base64
+import io
+import json
+import time
+from PIL import Image
+from utils.latency import percentile
+
+### Concurrent load against serve.py: throughput, client latency and the server's batch sizes
+
+QUESTIONS = ["biển số xe là gì?", "tên cửa hàng là gì?", "số điện thoại là gì?"]
+
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+async def client(host, port, image, num_requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    for i in range(num_requests):
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, "POST", "/predict",
+                                  {"image": image, "question": QUESTIONS[i % len(QUESTIONS)]})
+        if status == 200:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors.append(status)
+    writer.close()
+
+async def main(args):
+    if args.image:
+        with open(args.image, 'rb') as file:
+            image_bytes = file.read()
+    else:
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (120, 160, 200)).save(buffer, format='JPEG')
+        image_bytes = buffer.getvalue()
+    image = base64.b64encode(image_bytes).decode('ascii')
+
+    latencies, errors = [], []
+    per_client = args.num_requests // args.concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*[client(args.host, args.port, image, per_client, latencies, errors)
+                           for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, metrics = await request(reader, writer, "GET", "/metrics")
+    writer.close()
+
+    print(f"Concurrency {args.concurrency}: {len(latencies)} ok, {len(errors)} errors in {elapsed:.1f} s")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} requests/sec")
+    print(f"Client latency: p50 {percentile(latencies, 50):.1f} ms, p99 {percentile(latencies, 99):.1f} ms")
+    print(f"Server latency: p50 {metrics['latency_ms']['p50']:.1f} ms, p99 {metrics['latency_ms']['p99']:.1f} ms")
+    print(f"Server batch sizes: {metrics['batch_sizes']}")
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent connections")
+    parser.add_argument("--num_requests", type=int, default=512)
+    parser.add_argument("--image", type=str, default=None, help="Image file to send (a synthetic JPEG by default)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,54 @@
+import argparse
+import time
+import torch
+from configs.config import Config
+from utils.metrics import EMF1Accumulator, compute_em_and_f1
+
+### EMF1Accumulator against compute_em_and_f1 on random token-id pairs
+
+def to_words(ids):
+    # Same sequences as whitespace tokens for compute_em_and_f1, cut at </s> and without special ids
+    words = []
+    for row in ids.tolist():
+        row = row[:row.index(2)] if 2 in row else row
+        words.append([f"t{idx}" for idx in row if idx not in (0, 1, 2)])
+    return words
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_pairs", type=int, default=100000)
+    parser.add_argument("--batch_size", type=int, default=1024)
+    parser.add_argument("--vocab_size", type=int, default=200, help="Small vocabulary so pairs overlap")
+    args = parser.parse_args()
+
+    torch.manual_seed(Config.SEED)
+    length = Config.MAX_LEN_ANS - 1
+    references = torch.randint(0, args.vocab_size, (args.num_pairs, length))
+    predictions = references.clone()
+    # Corrupt about two tokens per row so EM and F1 are neither 0 nor 1
+    noise = torch.rand(references.shape) < 2 / length
+    predictions[noise] = torch.randint(0, args.vocab_size, (int(noise.sum()),))
+
+    start = time.perf_counter()
+    reference_words, prediction_words = to_words(references), to_words(predictions)
+    convert_s = time.perf_counter() - start
+    start = time.perf_counter()
+    em_sum, f1_sum = 0.0, 0.0
+    for i in range(0, args.num_pairs, args.batch_size):
+        em, f1 = compute_em_and_f1(reference_words[i:i + args.batch_size], prediction_words[i:i + args.batch_size])
+        size = len(reference_words[i:i + args.batch_size])
+        em_sum, f1_sum = em_sum + em * size, f1_sum + f1 * size
+    strings_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Set-based F1, as computed by compute_em_and_f1, so both report the same scores
+    metrics = EMF1Accumulator(vocab_size=args.vocab_size, bag=False)
+    for i in range(0, args.num_pairs, args.batch_size):
+        metrics.update(predictions[i:i + args.batch_size], references[i:i + args.batch_size])
+    tensor_em, tensor_f1 = metrics.compute()
+    tensor_s = time.perf_counter() - start
+
+    print(f"compute_em_and_f1: {strings_s:.3f} s (+{convert_s:.3f} s to build strings) "
+          f"EM {em_sum / args.num_pairs:.6f} F1 {f1_sum / args.num_pairs:.6f}")
+    print(f"EMF1Accumulator:   {tensor_s:.3f} s EM {tensor_em:.6f} F1 {tensor_f1:.6f}")
+    print(f"Speedup: {strings_s / tensor_s:.1f}x")
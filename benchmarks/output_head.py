@@ -0,0 +1,86 @@
+import argparse
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from configs.config import Config
+from benchmarks._common import add_worker_argument, peak_memory_mb, run_if_worker, run_worker
+from model.losses import chunked_cross_entropy
+
+### Peak memory and step time of the output layer + loss: full logits vs chunked, full vs reduced vocabulary
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+def full_loss(hidden, linear, targets):
+    # Same computation as train.py without loss_chunk_size
+    logits = linear(hidden).float()
+    predicted_ids = logits.detach().argmax(dim=-1)
+    return F.cross_entropy(logits.permute(0, 2, 1), targets, ignore_index=1), predicted_ids
+
+def run(batch_size, vocab_size, chunk_size, repeats):
+    """Forward + backward of the output layer in this process, returns its measurements and loss."""
+    torch.manual_seed(Config.SEED)
+    length = Config.MAX_LEN_ANS - 1
+    linear = nn.Linear(768, vocab_size).to(device)
+    hidden = torch.randn(batch_size, length, 768, device=device, requires_grad=True)
+    targets = torch.randint(4, vocab_size, (batch_size, length), device=device)
+    # Short answers followed by <pad>, like real batches
+    targets[:, length // 3:] = 1
+
+    def step():
+        if chunk_size:
+            loss, _ = chunked_cross_entropy(hidden, linear, targets, chunk_size=chunk_size)
+        else:
+            loss, _ = full_loss(hidden, linear, targets)
+        loss.backward()
+        return loss
+
+    baseline_mb = peak_memory_mb(device)
+    loss = step()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return {'peak_mb': peak_memory_mb(device), 'baseline_mb': baseline_mb,
+            'step_ms': (time.perf_counter() - start) / repeats * 1000, 'loss': loss.item()}
+
+def answer_vocab_size(csv_path):
+    from utils.data_processing import read_annotations
+    from utils.ViTextVQA_dataset import build_answer_vocab
+    return len(build_answer_vocab(read_annotations(csv_path, columns=['answer'])['answer']))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--chunk_sizes", type=str, default="1024,256", help="Chunk sizes of chunked_cross_entropy to try")
+    parser.add_argument("--train_csv_path", type=str, default=None, help="Training CSV or Parquet file to build the reduced answer vocabulary from")
+    parser.add_argument("--answer_vocab_size", type=int, default=None, help="Reduced vocabulary size when no CSV is given")
+    parser.add_argument("--repeats", type=int, default=10)
+    add_worker_argument(parser)
+    args = parser.parse_args()
+    run_if_worker(args, run, repeats=args.repeats)
+
+    vocab_sizes = [64001]
+    if args.train_csv_path:
+        vocab_sizes.append(answer_vocab_size(args.train_csv_path))
+    elif args.answer_vocab_size:
+        vocab_sizes.append(args.answer_vocab_size)
+
+    print(f"batch {args.batch_size} x {Config.MAX_LEN_ANS - 1} positions on {device.type}")
+    reference_ms = None
+    for vocab_size in vocab_sizes:
+        reference_loss = None
+        for chunk_size in [0] + [int(size) for size in args.chunk_sizes.split(",")]:
+            config = {'batch_size': args.batch_size, 'vocab_size': vocab_size, 'chunk_size': chunk_size}
+            name = f"vocab {vocab_size:6d} " + (f"chunks of {chunk_size:5d}" if chunk_size else "full logits     ")
+            try:
+                stats = run_worker("benchmarks.output_head", config, "--repeats", str(args.repeats))
+            except RuntimeError as e:
+                print(f"{name} FAILED: {e}")
+                continue
+            reference_ms = reference_ms or stats['step_ms']
+            reference_loss = reference_loss if reference_loss is not None else stats['loss']
+            print(f"{name} peak {stats['peak_mb']:9.1f} MB (+{stats['peak_mb'] - stats['baseline_mb']:8.1f} MB)  "
+                  f"{stats['step_ms']:8.2f} ms/step  speedup {reference_ms / stats['step_ms']:5.2f}x  "
+                  f"loss difference {abs(stats['loss'] - reference_loss):.1e}")
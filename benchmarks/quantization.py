@@ -0,0 +1,40 @@
+import contextlib
+import io
+import time
+import torch
+import torch.nn as nn
+from configs.arg_parser import get_args
+from configs.config import Config
+from model.inference import load_vqa_model
+from model.quantization import QUANTIZE_MODES, model_size_mb
+from utils.data_processing import preprocess_data
+from utils.ViTextVQA_dataset import ViTextVQA_Dataset, make_dataloader
+from test import evaluation
+
+### Dev-set EM/F1, latency and model size of each quantization mode against fp32 (CPU)
+
+if __name__=="__main__":
+    args = get_args()
+    device = torch.device('cpu')
+
+    _, df_dev, _ = preprocess_data(args)
+    dev_dataset = ViTextVQA_Dataset(df_dev, img_path=args.img_path, transform=Config.transforms, pretokenize=True)
+    # Same batches in the same order for every mode
+    dev_loader = make_dataloader(dev_dataset, args, shuffle=False)
+    criterion = nn.CrossEntropyLoss(ignore_index=1)
+
+    reference = None
+    print(f"{len(dev_dataset)} dev samples, batch {args.batch_size}, {'generate' if args.generate else 'teacher forcing'}")
+    for mode in QUANTIZE_MODES:
+        model = load_vqa_model(args.model_path + "/" + 'vi_text.pt', quantize=mode)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, em, f1 = evaluation(model, dev_loader, criterion, device, generate=args.generate,
+                                   num_beams=args.num_beams)
+        batch_ms = (time.perf_counter() - start) / len(dev_loader) * 1000
+        size_mb = model_size_mb(model)
+        reference = reference or (em, f1, batch_ms, size_mb)
+        print(f"{mode:10s} EM {em:.4f} ({em - reference[0]:+.4f})  F1 {f1:.4f} ({f1 - reference[1]:+.4f})  "
+              f"{batch_ms:8.1f} ms/batch ({reference[2] / batch_ms:4.2f}x)  "
+              f"weights {size_mb:7.1f} MB ({size_mb / reference[3]:5.1%})")
+        del model
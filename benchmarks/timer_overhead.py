@@ -0,0 +1,27 @@
+import argparse
+import time
+from utils.profiling import StageTimer
+
+### Cost of StageTimer.stage() per call, disabled and enabled, against an empty loop
+
+def time_loop(timer, repeats):
+    start = time.perf_counter()
+    if timer is None:
+        for _ in range(repeats):
+            pass
+    else:
+        for _ in range(repeats):
+            with timer.stage('stage'):
+                pass
+    return (time.perf_counter() - start) / repeats * 1e9
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=200000)
+    parser.add_argument("--stages_per_step", type=int, default=14, help="Stages timed in one training step")
+    args = parser.parse_args()
+
+    empty_ns = time_loop(None, args.repeats)
+    for name, timer in (('disabled', StageTimer(enabled=False)), ('enabled', StageTimer(enabled=True, sync=False))):
+        ns = time_loop(timer, args.repeats) - empty_ns
+        print(f"{name:9s} {ns:8.0f} ns per stage, {ns * args.stages_per_step / 1000:8.2f} us per training step")
@@ -0,0 +1,90 @@
+import argparse
+import contextlib
+import io
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+from configs.config import Config
+from benchmarks._common import add_worker_argument, peak_memory_mb, run_if_worker, run_worker
+
+### Peak memory and samples/sec of train() per (micro-batch, grad_accum_steps, activation checkpointing)
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+class SyntheticDataset(Dataset):
+    """Random images with a fixed tokenized question/answer, shaped like ViTextVQA_Dataset samples."""
+
+    def __init__(self, size):
+        from utils.ViTextVQA_dataset import tokenize_questions, tokenize_answers
+        self.size = size
+        ques_ids, ques_mask = tokenize_questions(["biển số xe là gì?"])
+        self.tokens = (torch.from_numpy(ques_ids[0]), torch.from_numpy(ques_mask[0]),
+                       torch.from_numpy(tokenize_answers(["51f 123.45"])[0]))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        image = torch.randint(0, 256, (3, 224, 224), dtype=torch.uint8)
+        return (str(idx), image, "biển số xe là gì?", "51f 123.45") + self.tokens
+
+def run(batch_size, grad_accum_steps, checkpointing, steps):
+    """Trains for steps optimizer steps in this process and returns its measurements."""
+    from transformers import get_linear_schedule_with_warmup
+    from model.vqa_model import VQAModel
+    from model.execution import apply_execution_mode
+    from train import train
+
+    torch.manual_seed(Config.SEED)
+    model = VQAModel().to(device)
+    apply_execution_mode(model, checkpointing=checkpointing)
+    optimizer = optim.AdamW(model.parameters(), Config.lr)
+    criterion = nn.CrossEntropyLoss(ignore_index=1)
+
+    def train_steps(num_steps):
+        loader = DataLoader(SyntheticDataset(num_steps * grad_accum_steps * batch_size), batch_size=batch_size)
+        scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_steps)
+        with contextlib.redirect_stdout(io.StringIO()):
+            train(model, loader, 1, optimizer, scheduler, criterion, None, device,
+                  grad_accum_steps=grad_accum_steps)
+
+    # Memory held by the model alone, before activations, gradients and optimizer state
+    baseline_mb = peak_memory_mb(device)
+    # Warm-up step allocates the optimizer state
+    train_steps(1)
+    start = time.perf_counter()
+    train_steps(steps)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return {'peak_mb': peak_memory_mb(device), 'baseline_mb': baseline_mb,
+            'samples_per_sec': steps * grad_accum_steps * batch_size / elapsed}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--effective_batch_size", type=int, default=16)
+    parser.add_argument("--batch_sizes", type=str, default="16,8,4,2", help="Micro-batch sizes to try")
+    parser.add_argument("--steps", type=int, default=3, help="Optimizer steps timed per configuration")
+    add_worker_argument(parser)
+    args = parser.parse_args()
+    run_if_worker(args, run, steps=args.steps)
+
+    print(f"effective batch {args.effective_batch_size} on {device.type}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        if args.effective_batch_size % batch_size:
+            continue
+        for checkpointing in (False, True):
+            config = {'batch_size': batch_size, 'grad_accum_steps': args.effective_batch_size // batch_size,
+                      'checkpointing': checkpointing}
+            name = (f"batch {batch_size:3d} x accum {config['grad_accum_steps']:2d}"
+                    f"{' + checkpointing' if checkpointing else '':16s}")
+            try:
+                stats = run_worker("benchmarks.train_memory", config, "--steps", str(args.steps))
+            except RuntimeError as e:
+                print(f"{name} FAILED: {e}")
+                continue
+            print(f"{name} peak {stats['peak_mb']:9.1f} MB "
+                  f"(+{stats['peak_mb'] - stats['baseline_mb']:8.1f} MB while training)  "
+                  f"{stats['samples_per_sec']:7.2f} samples/sec")
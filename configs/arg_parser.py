@@ -1,4 +1,5 @@
 import argparse
+import os
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -6,8 +7,48 @@ def get_args():
     parser.add_argument("--batch_size", type=int, default=4, help="Batch size for training the model")
     parser.add_argument("--epochs", type=int, default=10, help="Number of epochs for training")
     parser.add_argument("--img_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/images/st_images", help="Image path")
-    parser.add_argument("--train_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_train.csv", help="CSV path training")
-    parser.add_argument("--test_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_test.csv", help="CSV path testing")
-    parser.add_argument("--dev_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_dev.csv", help="CSV path dev")
+    parser.add_argument("--train_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_train.csv", help="CSV or Parquet path training")
+    parser.add_argument("--test_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_test.csv", help="CSV or Parquet path testing")
+    parser.add_argument("--dev_csv_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data/csv/ViTextVQA_dev.csv", help="CSV or Parquet path dev")
     parser.add_argument("--model_path", type=str, default="/Users/duyhoang/Documents/Research/VQA/VQA_Vi/data", help="Save path model")
+    parser.add_argument("--feature_path", type=str, default=None, help="Directory of precomputed DeiT features (see precompute_features.py)")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="Worker processes for data preprocessing and loading")
+    parser.add_argument("--prefetch_factor", type=int, default=4, help="Batches prefetched by each DataLoader worker")
+    parser.add_argument("--image_shard_path", type=str, default=None, help="Directory of pre-resized uint8 images (see precompute_features.py)")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of preprocessed data caches (next to the CSV files by default)")
+    parser.add_argument("--pretokenize", action="store_true", help="Tokenize the whole dataset once at startup instead of per sample")
+    parser.add_argument("--precision", type=str, default="fp32", choices=["fp32", "bf16"], help="Autocast precision of the forward pass")
+    parser.add_argument("--fused", action="store_true", help="Use fused scaled_dot_product_attention and layer_norm kernels in the decoder")
+    parser.add_argument("--compile", action="store_true", help="Compile the decoder with torch.compile")
+    parser.add_argument("--generate", action="store_true", help="Evaluate with autoregressive decoding instead of teacher forcing")
+    parser.add_argument("--num_beams", type=int, default=1, help="Beam size for autoregressive decoding (1 is greedy)")
+    parser.add_argument("--input_csv", type=str, default=None, help="CSV or Parquet file of (anno_id, image, question) rows to predict (test file by default)")
+    parser.add_argument("--output_path", type=str, default=None, help="Predictions file, .jsonl or .csv (model_path/predictions.jsonl by default)")
+    parser.add_argument("--queue_size", type=int, default=64, help="Capacity of the prediction pipeline queues")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address of the inference server")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the inference server")
+    parser.add_argument("--max_batch_size", type=int, default=16, help="Largest micro-batch formed by the inference server")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="Longest wait for a micro-batch to fill up")
+    parser.add_argument("--question_cache_mb", type=float, default=0, help="Size of the question embedding cache for inference (0 disables it)")
+    parser.add_argument("--image_cache_mb", type=float, default=0, help="Size of the image embedding cache for inference (0 disables it)")
+    parser.add_argument("--result_cache_mb", type=float, default=0, help="Size of the (image, question) answer cache for inference (0 disables it)")
+    parser.add_argument("--checkpoint_dir", type=str, default=None, help="Directory of training checkpoints (model_path/checkpoints by default)")
+    parser.add_argument("--save_every", type=int, default=1000, help="Optimizer steps between checkpoints (0 only saves at the end of each epoch)")
+    parser.add_argument("--keep_last", type=int, default=3, help="Number of checkpoints kept on disk")
+    parser.add_argument("--resume", action="store_true", help="Resume training from the latest checkpoint in checkpoint_dir")
+    parser.add_argument("--grad_accum_steps", type=int, default=1, help="Batches whose gradients are accumulated per optimizer step")
+    parser.add_argument("--activation_checkpointing", action="store_true", help="Recompute PhoBERT and decoder layer activations in backward to save memory")
+    parser.add_argument("--loss_chunk_size", type=int, default=0, help="Compute the output layer and loss this many positions at a time (0 computes the full logits)")
+    parser.add_argument("--answer_vocab", action="store_true", help="Restrict the output layer to the tokens used by the training answers")
+    parser.add_argument("--dist_backend", type=str, default="gloo", choices=["gloo", "nccl"], help="Process group backend when launched with torchrun")
+    parser.add_argument("--log_every", type=int, default=2000, help="Batches between progress and throughput logs")
+    parser.add_argument("--timing", action="store_true", help="Log per-stage timings (data, DeiT, PhoBERT, SAN, decoder, head, loss, backward, ...)")
+    parser.add_argument("--profile_dir", type=str, default=None, help="Write a torch.profiler trace of a window of steps to this directory")
+    parser.add_argument("--profile_wait", type=int, default=10, help="Steps skipped before the profiler window")
+    parser.add_argument("--profile_active", type=int, default=5, help="Steps recorded in the profiler window")
+    parser.add_argument("--quantize", type=str, default="none", choices=["none", "int8", "int8_deit"], help="Int8 dynamic quantization for CPU inference (int8_deit also quantizes DeiT)")
+    parser.add_argument("--export_dir", type=str, default=None, help="Directory of TorchScript graphs written by export.py, used by predict and serve instead of vi_text.pt")
+    parser.add_argument("--bucket_by_length", action="store_true", help="Batch answers of similar length together and pad each batch to its longest answer")
+    parser.add_argument("--bucket_pool_size", type=int, default=100, help="Batches per length-sorted pool with --bucket_by_length")
+    parser.add_argument("--group_by_image", action="store_true", help="Batch the questions about one image together and encode each image once per batch")
     return parser.parse_args()
\ No newline at end of file
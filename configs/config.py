@@ -1,5 +1,15 @@
 import os
-import torchvision.transforms as transforms
+
+class ImageTransforms:
+    # Built on first access so importing Config does not import torchvision
+    def __get__(self, obj, owner):
+        import torchvision.transforms as transforms
+        # Resize only; ImageEmbedding normalizes the uint8 batch on device
+        value = transforms.Compose([transforms.Resize((224, 224)),
+                                    transforms.PILToTensor(),
+                                    ])
+        owner.transforms = value
+        return value
 
 class Config:
     lr = 0.00001
@@ -16,6 +26,4 @@ class Config:
     MAX_LEN_QUES = 28
     MAX_LEN_ANS = 38
     NUM_WORKERS = os.cpu_count()
-    transforms = transforms.Compose([transforms.Resize((224, 224)),
-                                    transforms.ToTensor(),
-                                    ])
\ No newline at end of file
+    transforms = ImageTransforms()
\ No newline at end of file
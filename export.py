@@ -0,0 +1,27 @@
+import os
+import torch
+from configs.arg_parser import get_args
+from configs.config import Config
+from model.inference import load_vqa_model
+from model.export import export_model, check_parity
+from model.exported import ExportedVQAModel
+
+### Export vi_text.pt to TorchScript graphs over tensor inputs, for predict/serve --export_dir
+
+if __name__=="__main__":
+    args = get_args()
+    torch.manual_seed(Config.SEED)
+    export_dir = args.export_dir or os.path.join(args.model_path, 'exported')
+
+    model = load_vqa_model(os.path.join(args.model_path, 'vi_text.pt'), fused=args.fused, quantize=args.quantize)
+    export_model(model, export_dir)
+    print(f"Exported to {export_dir}")
+
+    # Parity against the eager model, at batch sizes other than the traced one
+    exported = ExportedVQAModel(export_dir)
+    for batch_size in (1, 8):
+        result = check_parity(model, exported, batch_size)
+        status = "ok" if result['same_tokens'] and result['log_probs_diff'] < 1e-3 else "MISMATCH"
+        print(f"batch {batch_size}: context max abs diff {result['context_diff']:.2e}, "
+              f"log-probs max abs diff {result['log_probs_diff']:.2e}, "
+              f"same greedy tokens: {result['same_tokens']} {status}")
@@ -0,0 +1,24 @@
+import functools
+from configs.config import Config
+
+### Shared pretrained backbones, transformers is only imported on first use
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name=Config.textmodel_dir):
+    # Tokenizers are read-only, so one instance per name serves the whole process
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+def load_text_model(name=Config.textmodel_dir):
+    # Not cached: each VQAModel owns its weights and shares them between its submodules
+    from transformers import AutoModel
+    return AutoModel.from_pretrained(name)
+
+@functools.lru_cache(maxsize=None)
+def load_image_processor(name=Config.image_model):
+    from transformers import AutoImageProcessor
+    return AutoImageProcessor.from_pretrained(name)
+
+def load_image_model(name=Config.image_model):
+    from transformers import DeiTModel
+    return DeiTModel.from_pretrained(name)
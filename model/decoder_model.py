@@ -1,9 +1,15 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 import math
 
-def scaled_dot_product(q, k, v, mask=None):
+def scaled_dot_product(q, k, v, mask=None, fused=False):
+    if fused:
+        # Fused kernel, attention weights are not materialized
+        if mask is not None:
+            mask = mask.to(q.dtype)
+        return F.scaled_dot_product_attention(q, k, v, attn_mask=mask), None
     d_k = q.size()[-1] 
     scaled = torch.matmul(q, k.transpose(-1, -2)) / math.sqrt(d_k) 
     if mask is not None:
@@ -12,6 +18,24 @@ def scaled_dot_product(q, k, v, mask=None):
     values = torch.matmul(attention, v)
     return values, attention
 
+def update_cache(cache, k, v):
+    """
+    Appends the keys/values of the new positions to a per-layer cache.
+    :param cache: Dict holding 'k' and 'v' of the previous steps (empty on the first step).
+    :return: Keys and values of all positions so far.
+    """
+    if 'k' in cache:
+        k = torch.cat([cache['k'], k], dim=2)
+        v = torch.cat([cache['v'], v], dim=2)
+    cache['k'], cache['v'] = k, v
+    return k, v
+
+def set_fused(module, fused):
+    """Switches every attention and layer norm under module between the fused and reference kernels."""
+    for submodule in module.modules():
+        if isinstance(submodule, (LayerNormalization, MultiHeadAttention, MultiHeadCrossAttention)):
+            submodule.fused = fused
+    return module
 
 class PositionwiseFeedForward(nn.Module):
     def __init__(self, d_model, hidden, drop_prob=0.1):
@@ -30,14 +54,17 @@ class PositionwiseFeedForward(nn.Module):
 
 
 class LayerNormalization(nn.Module):
-    def __init__(self, parameters_shape, eps=1e-5):
+    def __init__(self, parameters_shape, eps=1e-5, fused=False):
         super().__init__()
         self.parameters_shape=parameters_shape
         self.eps=eps
+        self.fused = fused
         self.gamma = nn.Parameter(torch.ones(parameters_shape)) # 512
         self.beta =  nn.Parameter(torch.zeros(parameters_shape)) # 512
 
     def forward(self, inputs):
+        if self.fused:
+            return F.layer_norm(inputs, self.parameters_shape, self.gamma, self.beta, self.eps)
         dims = [-(i + 1) for i in range(len(self.parameters_shape))] # [-1]
         mean = inputs.mean(dim=dims, keepdim=True) 
         var = ((inputs - mean) ** 2).mean(dim=dims, keepdim=True)
@@ -48,74 +75,84 @@ class LayerNormalization(nn.Module):
 
 class MultiHeadAttention(nn.Module):
 
-    def __init__(self, d_model, num_heads):
+    def __init__(self, d_model, num_heads, fused=False):
         super().__init__()
         self.d_model = d_model
         self.num_heads = num_heads
         self.head_dim = d_model // num_heads
+        self.fused = fused
         self.qkv_layer = nn.Linear(d_model , 3 * d_model) 
         self.linear_layer = nn.Linear(d_model, d_model)
     
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, cache=None):
         batch_size, sequence_length, d_model = x.size() 
         qkv = self.qkv_layer(x) 
         qkv = qkv.reshape(batch_size, sequence_length, self.num_heads, 3 * self.head_dim)
         qkv = qkv.permute(0, 2, 1, 3) 
         q, k, v = qkv.chunk(3, dim=-1) 
-        values, attention = scaled_dot_product(q, k, v, mask) 
-        values = values.reshape(batch_size, sequence_length, self.num_heads * self.head_dim) 
+        if cache is not None:
+            k, v = update_cache(cache, k, v)
+        values, attention = scaled_dot_product(q, k, v, mask, fused=self.fused) 
+        values = values.permute(0, 2, 1, 3).reshape(batch_size, sequence_length, self.num_heads * self.head_dim) 
         out = self.linear_layer(values)
         return out
 
 
 class MultiHeadCrossAttention(nn.Module):
 
-    def __init__(self, d_model, num_heads):
+    def __init__(self, d_model, num_heads, fused=False):
         super().__init__()
         self.d_model = d_model
         self.num_heads = num_heads
         self.head_dim = d_model // num_heads
+        self.fused = fused
         self.kv_layer = nn.Linear(d_model , 2 * d_model) # 1024
         self.q_layer = nn.Linear(d_model , d_model)
         self.linear_layer = nn.Linear(d_model, d_model)
     
-    def forward(self, x, y, mask=None):
-        batch_size, sequence_length, d_model = x.size()
+    def forward(self, x, y, mask=None, cache=None):
+        batch_size, kv_length, d_model = x.size()
+        sequence_length = y.size(1)
         kv = self.kv_layer(x) 
         q = self.q_layer(y) 
-        kv = kv.reshape(batch_size, sequence_length, self.num_heads, 2 * self.head_dim)
+        kv = kv.reshape(batch_size, kv_length, self.num_heads, 2 * self.head_dim)
         q = q.reshape(batch_size, sequence_length, self.num_heads, self.head_dim) 
         kv = kv.permute(0, 2, 1, 3) 
         q = q.permute(0, 2, 1, 3) 
         k, v = kv.chunk(2, dim=-1) 
-        values, attention = scaled_dot_product(q, k, v, mask) 
-        values = values.reshape(batch_size, sequence_length, d_model) 
+        if cache is not None:
+            k, v = update_cache(cache, k, v)
+        values, attention = scaled_dot_product(q, k, v, mask, fused=self.fused) 
+        values = values.permute(0, 2, 1, 3).reshape(batch_size, sequence_length, d_model) 
         out = self.linear_layer(values) 
         return out  
 
 
 class DecoderLayer(nn.Module):
 
-    def __init__(self, d_model, ffn_hidden, num_heads, drop_prob):
+    def __init__(self, d_model, ffn_hidden, num_heads, drop_prob, fused=False):
         super(DecoderLayer, self).__init__()
-        self.self_attention = MultiHeadAttention(d_model=d_model, num_heads=num_heads)
-        self.norm1 = LayerNormalization(parameters_shape=[d_model])
+        self.self_attention = MultiHeadAttention(d_model=d_model, num_heads=num_heads, fused=fused)
+        self.norm1 = LayerNormalization(parameters_shape=[d_model], fused=fused)
         self.dropout1 = nn.Dropout(p=drop_prob)
-        self.encoder_decoder_attention = MultiHeadCrossAttention(d_model=d_model, num_heads=num_heads)
-        self.norm2 = LayerNormalization(parameters_shape=[d_model])
+        self.encoder_decoder_attention = MultiHeadCrossAttention(d_model=d_model, num_heads=num_heads, fused=fused)
+        self.norm2 = LayerNormalization(parameters_shape=[d_model], fused=fused)
         self.dropout2 = nn.Dropout(p=drop_prob)
         self.ffn = PositionwiseFeedForward(d_model=d_model, hidden=ffn_hidden, drop_prob=drop_prob)
-        self.norm3 = LayerNormalization(parameters_shape=[d_model])
+        self.norm3 = LayerNormalization(parameters_shape=[d_model], fused=fused)
         self.dropout3 = nn.Dropout(p=drop_prob)
 
-    def forward(self, x, y, decoder_mask):
+    def forward(self, x, y, decoder_mask, cross_mask=None, cache=None):
+        self_cache = cache['self'] if cache is not None else None
+        cross_cache = cache['cross'] if cache is not None else None
+
         _y = y
-        y = self.self_attention(y, mask=decoder_mask)
+        y = self.self_attention(y, mask=decoder_mask, cache=self_cache)
         y = self.dropout1(y)
         y = self.norm1(y + _y)
 
         _y = y # 30 x 200 x 512
-        y = self.encoder_decoder_attention(x, y, mask=None)
+        y = self.encoder_decoder_attention(x, y, mask=cross_mask, cache=cross_cache)
         y = self.dropout2(y)
         y = self.norm2(y + _y)
 
@@ -126,18 +163,35 @@ class DecoderLayer(nn.Module):
         return y 
 
 class SequentialDecoder(nn.Sequential):
+    # Recompute each layer's activations in backward instead of storing them
+    gradient_checkpointing = False
+
     def forward(self, *inputs):
-        x, y, mask = inputs
-        for module in self._modules.values():
-            y = module(x, y, mask)
+        x, y, mask, cross_mask, cache = inputs
+        for i, module in enumerate(self._modules.values()):
+            if self.gradient_checkpointing and self.training and cache is None:
+                y = checkpoint(module, x, y, mask, cross_mask, None, use_reentrant=False)
+            else:
+                y = module(x, y, mask, cross_mask, cache[i] if cache is not None else None)
         return y
 
 class Decoder(nn.Module):
-    def __init__(self, d_model, ffn_hidden, num_heads, drop_prob, num_layers=1):
+    def __init__(self, d_model, ffn_hidden, num_heads, drop_prob, num_layers=1, fused=False):
         super().__init__()
-        self.layers = SequentialDecoder(*[DecoderLayer(d_model, ffn_hidden, num_heads, drop_prob) 
+        self.layers = SequentialDecoder(*[DecoderLayer(d_model, ffn_hidden, num_heads, drop_prob, fused) 
                                           for _ in range(num_layers)])
 
-    def forward(self, x, y, mask):
-        y = self.layers(x, y, mask)
-        return y
\ No newline at end of file
+    def forward(self, x, y, mask, cross_mask=None, cache=None):
+        y = self.layers(x, y, mask, cross_mask, cache)
+        return y
+
+    def init_cache(self):
+        return [{'self': {}, 'cross': {}} for _ in range(len(self.layers))]
+
+    @staticmethod
+    def reorder_cache(cache, index):
+        for layer_cache in cache:
+            for attention_cache in layer_cache.values():
+                for key, value in attention_cache.items():
+                    attention_cache[key] = value.index_select(0, index)
+        return cache
\ No newline at end of file
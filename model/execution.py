@@ -0,0 +1,40 @@
+import contextlib
+import torch
+from model.decoder_model import set_fused
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+### Execution modes: bf16 autocast, fused attention/layer norm kernels, torch.compile and activation checkpointing
+
+PRECISIONS = ('fp32', 'bf16')
+
+def autocast(precision='fp32'):
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision == 'bf16':
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    raise ValueError(f"Unknown precision: {precision}")
+
+def set_activation_checkpointing(model, enabled):
+    """
+    Recomputes the PhoBERT encoder and decoder layer activations during backward instead of
+    keeping them, trading compute for memory. Only applies in training mode.
+    """
+    phobert = model.ques_model.phobert
+    if enabled:
+        phobert.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+    else:
+        phobert.gradient_checkpointing_disable()
+    model.decoder.layers.gradient_checkpointing = enabled
+    return model
+
+def apply_execution_mode(model, fused=False, compile=False, checkpointing=False):
+    """
+    Selects the decoder kernels of a VQAModel and optionally compiles the decoder.
+    The decoder is compiled in place, so state_dict keys are unchanged.
+    """
+    set_fused(model, fused)
+    set_activation_checkpointing(model, checkpointing)
+    if compile:
+        model.decoder.compile()
+    return model
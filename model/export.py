@@ -0,0 +1,103 @@
+import json
+import os
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from configs.config import Config
+from model.vqa_model import BOS_ID, PAD_ID, EOS_ID, causal_mask
+
+### Tensor-only graphs of VQAModel for TorchScript export, loaded back by model/exported.py
+
+class EncoderGraph(nn.Module):
+    """(uint8 images, question ids, question mask) -> SAN context (batch, d_model)."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images, ques_ids, ques_mask):
+        return self.model.encode(images, ques_ids, ques_mask)
+
+class DecoderStepGraph(nn.Module):
+    """
+    (context, prefix, step) -> log-probabilities of the token after prefix[:, step].
+    The prefix always has max_len positions (head indices, padded), so the graph has fixed shapes
+    and no cache; the causal mask keeps the positions after step out of the result.
+    """
+
+    def __init__(self, model, max_len=Config.MAX_LEN_ANS):
+        super().__init__()
+        self.model = model
+        self.register_buffer('mask', causal_mask(max_len), persistent=False)
+
+    def forward(self, context, prefix, step):
+        x = self.model.ans_model.embed(self.model.to_token_ids(prefix))
+        y = context.unsqueeze(1).expand(-1, prefix.size(1), -1)
+        out = self.model.decoder(x, y, self.mask, cross_mask=self.mask)
+        hidden = out.index_select(1, step).squeeze(1)
+        return F.log_softmax(self.model.mlp(hidden).float(), dim=-1)
+
+def example_inputs(batch_size, device, max_len=Config.MAX_LEN_ANS):
+    from utils.ViTextVQA_dataset import tokenize_questions
+    images = torch.randint(0, 256, (batch_size, 3, 224, 224), dtype=torch.uint8, device=device)
+    ques_ids, ques_mask = tokenize_questions(["biển số xe là gì?"] * batch_size)
+    prefix = torch.full((batch_size, max_len), PAD_ID, dtype=torch.long, device=device)
+    prefix[:, 0] = BOS_ID
+    return (images, torch.from_numpy(ques_ids).long().to(device), torch.from_numpy(ques_mask).long().to(device),
+            prefix)
+
+@torch.no_grad()
+def export_model(model, export_dir, batch_size=2, max_len=Config.MAX_LEN_ANS):
+    """
+    Traces an eval-mode VQAModel into encoder.pt and decoder_step.pt under export_dir.
+    The graphs run on the device the model is on.
+    """
+    model.eval()
+    device = next(model.parameters()).device
+    images, ques_ids, ques_mask, prefix = example_inputs(batch_size, device, max_len)
+
+    encoder = torch.jit.trace(EncoderGraph(model).eval(), (images, ques_ids, ques_mask))
+    context = encoder(images, ques_ids, ques_mask)
+    decoder_step = torch.jit.trace(DecoderStepGraph(model, max_len).eval(),
+                                   (context, prefix, torch.tensor([0], device=device)))
+
+    os.makedirs(export_dir, exist_ok=True)
+    torch.jit.save(encoder, os.path.join(export_dir, 'encoder.pt'))
+    torch.jit.save(decoder_step, os.path.join(export_dir, 'decoder_step.pt'))
+    config = {
+        'max_len': max_len, 'bos_id': BOS_ID, 'pad_id': PAD_ID, 'eos_id': EOS_ID, 'device': str(device),
+        'answer_vocab': model.answer_vocab.tolist() if model.answer_vocab is not None else None,
+    }
+    with open(os.path.join(export_dir, 'config.json'), 'w', encoding='utf-8') as file:
+        json.dump(config, file)
+    return export_dir
+
+@torch.no_grad()
+def check_parity(model, exported, batch_size, questions=None):
+    """
+    Compares an ExportedVQAModel with the eager model on random images.
+    :return: Dict with the max abs difference of the contexts and of the first-step
+        log-probabilities, and whether greedy decoding gives the same tokens.
+    """
+    from utils.ViTextVQA_dataset import tokenize_questions
+    device = next(model.parameters()).device
+    questions = questions or ["biển số xe là gì?", "tên cửa hàng là gì?", "có bao nhiêu người?"]
+    images = torch.randint(0, 256, (batch_size, 3, 224, 224), dtype=torch.uint8, device=device)
+    ques_ids, ques_mask = tokenize_questions([questions[i % len(questions)] for i in range(batch_size)])
+    ques_ids, ques_mask = torch.from_numpy(ques_ids).long(), torch.from_numpy(ques_mask).long()
+
+    context = model.encode(images, ques_ids, ques_mask)
+    exported_context = exported.encode(images, ques_ids, ques_mask)
+    bos = torch.full((batch_size, 1), BOS_ID, dtype=torch.long, device=device)
+    log_probs = model._decode_step(context, bos, cache=None)
+    prefix = torch.full((batch_size, exported.max_len), PAD_ID, dtype=torch.long, device=device)
+    prefix[:, 0] = BOS_ID
+    exported_log_probs = exported.decoder_step(context, prefix, torch.tensor([0], device=device))
+
+    tokens = model.generate_from_context(context)
+    exported_tokens = exported.generate_from_context(context)
+    return {
+        'context_diff': (context - exported_context).abs().max().item(),
+        'log_probs_diff': (log_probs - exported_log_probs).abs().max().item(),
+        'same_tokens': tokens.shape == exported_tokens.shape and torch.equal(tokens, exported_tokens),
+    }
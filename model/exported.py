@@ -0,0 +1,67 @@
+import json
+import os
+import torch
+
+### Runs a VQAModel exported by export.py, needs neither transformers nor the model code
+
+class ExportedVQAModel:
+    """
+    TorchScript encoder and decoder-step graphs with a greedy decoding loop.
+    Inputs are tensors only: uint8 images, question ids and mask (see tokenize_questions).
+    :param export_dir: Directory written by export.py.
+    :param device: Device to load the graphs on, the export device by default.
+    """
+
+    def __init__(self, export_dir, device=None):
+        with open(os.path.join(export_dir, 'config.json'), 'r', encoding='utf-8') as file:
+            self.config = json.load(file)
+        map_location = device or self.config['device']
+        self.encoder = torch.jit.load(os.path.join(export_dir, 'encoder.pt'), map_location=map_location)
+        self.decoder_step = torch.jit.load(os.path.join(export_dir, 'decoder_step.pt'), map_location=map_location)
+        self.device = torch.device(map_location)
+        self.max_len = self.config['max_len']
+        self.answer_vocab = None
+        if self.config['answer_vocab'] is not None:
+            self.answer_vocab = torch.tensor(self.config['answer_vocab'], dtype=torch.long, device=self.device)
+
+    def eval(self):
+        return self
+
+    def to_token_ids(self, head_ids):
+        if self.answer_vocab is None:
+            return head_ids
+        return self.answer_vocab[head_ids]
+
+    @torch.no_grad()
+    def encode(self, images, ques_ids, ques_mask):
+        return self.encoder(images.to(self.device), ques_ids.to(self.device).long(), ques_mask.to(self.device).long())
+
+    @torch.no_grad()
+    def generate_from_context(self, context, max_len=None, num_beams=1):
+        """
+        Greedy decoding from <s> to </s>, same output as VQAModel.generate_from_context.
+        :return: Token ids (batch, length) starting with <s>, padded after </s>.
+        """
+        if num_beams != 1:
+            raise ValueError("Exported models only support greedy decoding (num_beams=1)")
+        max_len = min(max_len or self.max_len, self.max_len)
+        bos_id, pad_id, eos_id = self.config['bos_id'], self.config['pad_id'], self.config['eos_id']
+        batch_size = context.size(0)
+        # The graph always sees a full-length prefix, the causal mask hides the positions after step
+        prefix = torch.full((batch_size, self.max_len), pad_id, dtype=torch.long, device=context.device)
+        prefix[:, 0] = bos_id
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=context.device)
+        length = max_len
+        for step in range(max_len - 1):
+            log_probs = self.decoder_step(context, prefix, torch.tensor([step], device=context.device))
+            next_tokens = log_probs.argmax(dim=-1).masked_fill(finished, pad_id)
+            prefix[:, step + 1] = next_tokens
+            finished |= next_tokens == eos_id
+            if finished.all():
+                length = step + 2
+                break
+        return self.to_token_ids(prefix[:, :length])
+
+    def generate(self, images, ques_ids, ques_mask, max_len=None, num_beams=1):
+        return self.generate_from_context(self.encode(images, ques_ids, ques_mask), max_len=max_len,
+                                          num_beams=num_beams)
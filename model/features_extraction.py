@@ -1,72 +1,94 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-from transformers import AutoModel, AutoTokenizer, AutoImageProcessor, DeiTModel
 from configs.config import Config
-from configs.arg_parser import get_args
-from utils.data_processing import preprocess_data
-from utils.ViTextVQA_dataset import ViTextVQA_Dataset
+from model.backbones import load_image_model, load_image_processor, load_text_model
 
-args = get_args()
 device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
 ### Image features extraction model
 class ImageEmbedding(nn.Module):
     def __init__(self):
         super(ImageEmbedding, self).__init__()
-        self.process = AutoImageProcessor.from_pretrained(Config.image_model)
-        self.model = DeiTModel.from_pretrained(Config.image_model)
+        process = load_image_processor()
+        self.model = load_image_model()
         #self.model = nn.Sequential(*list(self.model.children())[:3])
         
         for param in self.model.parameters():
             param.requires_grad = False
 
+        # uint8 pixels -> (x / 255 - mean) / std folded into one multiply-add
+        mean = torch.tensor(process.image_mean).view(1, 3, 1, 1)
+        std = torch.tensor(process.image_std).view(1, 3, 1, 1)
+        self.register_buffer('pixel_scale', 1.0 / (255.0 * std), persistent=False)
+        self.register_buffer('pixel_shift', -mean / std, persistent=False)
+
     def forward(self, image, image_ids):
-        inputs = self.process(image, return_tensors="pt")
+        if image.dim() == 3:
+            # Precomputed last_hidden_state read from the feature store
+            return image.to(device).float(), image_ids
+
+        # Images come resized to 224x224 uint8 from the dataset and are normalized on device
+        pixel_values = torch.addcmul(self.pixel_shift, image.to(device).float(), self.pixel_scale)
         with torch.no_grad():
-            outputs = self.model(**inputs.to(device))
+            outputs = self.model(pixel_values=pixel_values)
             
         image_embedding = outputs.last_hidden_state
         return image_embedding, image_ids
     
 ### Quesion embedding model
 class QuesEmbedding(nn.Module):
-    def __init__(self, input_size=768, output_size=768):
+    def __init__(self, input_size=768, output_size=768, phobert=None):
         super(QuesEmbedding, self).__init__()
-        self.tokenizer = AutoTokenizer.from_pretrained(Config.textmodel_dir)
-        self.phobert = AutoModel.from_pretrained(Config.textmodel_dir)
+        self.phobert = phobert if phobert is not None else load_text_model()
+        # The pooler output is never used, frozen it does not leave DistributedDataParallel waiting for its gradients
+        if getattr(self.phobert, 'pooler', None) is not None:
+            for param in self.phobert.pooler.parameters():
+                param.requires_grad = False
         self.lstm = nn.LSTM(input_size, output_size, batch_first=True)
 
-    def forward(self, ques):
-        tokenized_input = self.tokenizer(ques, return_tensors='pt', padding='max_length', max_length=Config.MAX_LEN_QUES, truncation=True)
-        ques = self.phobert(**tokenized_input.to(device)).last_hidden_state
+    def forward(self, ques_ids, ques_mask):
+        ques = self.phobert(input_ids=ques_ids.to(device).long(),
+                            attention_mask=ques_mask.to(device).long()).last_hidden_state
         _, (h, _) = self.lstm(ques)
         return h.squeeze(0)
     
 ### Answer embedding model
 class AnsEmbedding(nn.Module):
-    def __init__(self, input_size=768):
+    def __init__(self, input_size=768, embeddings=None):
         super(AnsEmbedding, self).__init__()
-        self.tokenizer = AutoTokenizer.from_pretrained(Config.textmodel_dir)
-        self.phobert_embed = AutoModel.from_pretrained(Config.textmodel_dir).embeddings.to(device)
+        # Only the embedding table is used, pass the question encoder's to avoid loading PhoBERT again
+        self.phobert_embed = embeddings if embeddings is not None else load_text_model().embeddings
 
-    def forward(self, ans):   
-        tokenized_input = self.tokenizer(ans, return_tensors='pt', padding='max_length', max_length=Config.MAX_LEN_ANS, truncation=True, return_attention_mask=False)
-        ans = self.phobert_embed(**tokenized_input.to(device))
-        return tokenized_input['input_ids'], ans
+    def forward(self, ans_ids):
+        ans_ids = ans_ids.to(device).long()
+        ans = self.phobert_embed(input_ids=ans_ids)
+        return ans_ids, ans
+
+    def embed(self, input_ids, past_length=0):
+        # Explicit positions so a single new token can be embedded during generation
+        position_ids = torch.arange(past_length, past_length + input_ids.size(1), device=input_ids.device)
+        position_ids = (position_ids + self.phobert_embed.padding_idx + 1).unsqueeze(0).expand_as(input_ids)
+        return self.phobert_embed(input_ids=input_ids, position_ids=position_ids,
+                                  token_type_ids=torch.zeros_like(input_ids))
     
 
 if __name__=="__main__":
+    from torch.utils.data import DataLoader
+    from configs.arg_parser import get_args
+    from utils.data_processing import preprocess_data
+    from utils.ViTextVQA_dataset import ViTextVQA_Dataset
+
+    args = get_args()
     df_train, _, _ = preprocess_data(args)
-    train_vlsp_dataset = ViTextVQA_Dataset(df_train, transform=Config.transforms)
+    train_vlsp_dataset = ViTextVQA_Dataset(df_train, img_path=args.img_path, transform=Config.transforms)
     train_loader = DataLoader(train_vlsp_dataset, batch_size=args.batch_size, shuffle=True)
 
     image_model = ImageEmbedding().to(device)
     ques_model = QuesEmbedding(output_size=768).to(device)
-    ans_model = AnsEmbedding()
+    ans_model = AnsEmbedding(embeddings=ques_model.phobert.embeddings)
 
     for batch in train_loader:
-        anno_ids, images, questions, answers = batch
+        anno_ids, images, questions, answers, ques_ids, ques_mask, ans_ids = batch
         if torch.cuda.is_available():
             images = images.cuda()
             questions = questions
@@ -75,11 +97,11 @@ if __name__=="__main__":
         
         with torch.no_grad():
             image_embeddings, att_ids = image_model(images, image_ids=anno_ids)
-            ques_embeddings = ques_model(questions)
-            ans_vocab, ans_embedds = ans_model(answers)
+            ques_embeddings = ques_model(ques_ids, ques_mask)
+            ans_vocab, ans_embedds = ans_model(ans_ids)
         break    
 
-    image_embeddings = image_embeddings.reshape(args.batch_size, 768, -1).permute(0, 2, 1)
+    image_embeddings = image_embeddings.reshape(image_embeddings.size(0), 768, -1).permute(0, 2, 1)
     ques_embeddings = ques_embeddings.unsqueeze(1)
     print("image embedding size: ", image_embeddings.size())
     print("question embedding size ", ques_embeddings.size())
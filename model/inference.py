@@ -0,0 +1,151 @@
+import hashlib
+import io
+import os
+import torch
+from PIL import Image
+from configs.config import Config
+from model.backbones import get_tokenizer
+from model.execution import autocast, apply_execution_mode
+from model.vqa_model import VQAModel
+from model.quantization import quantize_model
+from model.exported import ExportedVQAModel
+from utils.decoding import TokenDecoder
+from utils.ViTextVQA_dataset import tokenize_questions
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+### Inference helpers shared by predict.py and serve.py
+
+def load_vqa_model(checkpoint_path, fused=False, compile=False, quantize='none'):
+    """
+    :param quantize: Int8 dynamic quantization mode for CPU inference, see quantize_model.
+    """
+    if quantize != 'none' and compile:
+        raise ValueError("--compile is not supported together with --quantize")
+    state_dict = torch.load(checkpoint_path, map_location=device)
+    model = VQAModel(answer_vocab=state_dict.get('answer_vocab')).to(device)
+    model.load_state_dict(state_dict)
+    model.eval()
+    apply_execution_mode(model, fused=fused, compile=compile)
+    return quantize_model(model, quantize)
+
+def load_serving_model(args):
+    """Exported graphs when --export_dir is given, otherwise vi_text.pt from --model_path."""
+    if args.export_dir:
+        return ExportedVQAModel(args.export_dir)
+    return load_vqa_model(os.path.join(args.model_path, 'vi_text.pt'), fused=args.fused, compile=args.compile,
+                          quantize=args.quantize)
+
+def load_image(source):
+    """
+    Decodes and resizes an image like the dataset does.
+    :param source: File path or encoded image bytes.
+    :return: uint8 tensor (3, 224, 224).
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return Config.transforms(Image.open(source).convert('RGB'))
+
+def image_key(image_bytes):
+    # Content hash used by the image and result caches
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def normalize_question(question):
+    return ' '.join(str(question).split())
+
+class Predictor:
+    """
+    Answers batches of (image, question) pairs with VQAModel.generate.
+    The optional caches are ByteLRUCache instances: question embeddings keyed by normalized
+    question text, image embeddings keyed by image content hash, and answers keyed by both.
+    :param model: VQAModel in eval mode, or an ExportedVQAModel.
+    :param num_beams: Beam size, 1 is greedy decoding.
+    :param precision: 'fp32' or 'bf16' autocast.
+    """
+
+    def __init__(self, model, num_beams=1, precision='fp32', question_cache=None, image_cache=None,
+                 result_cache=None):
+        if getattr(model, 'quantized', 'none') != 'none' and precision != 'fp32':
+            raise ValueError(f"Quantized models run in fp32, got precision {precision}")
+        if isinstance(model, ExportedVQAModel):
+            if precision != 'fp32':
+                raise ValueError(f"Exported models run in fp32, got precision {precision}")
+            if question_cache is not None or image_cache is not None:
+                # The exported encoder is a single graph, its intermediate embeddings cannot be cached
+                raise ValueError("Exported models only support the result cache")
+        self.model = model
+        self.num_beams = num_beams
+        self.precision = precision
+        self.token_decoder = TokenDecoder(get_tokenizer())
+        self.question_cache = question_cache
+        self.image_cache = image_cache
+        self.result_cache = result_cache
+
+    def cache_stats(self):
+        caches = {"question": self.question_cache, "image": self.image_cache, "result": self.result_cache}
+        return {name: cache.stats() for name, cache in caches.items() if cache is not None}
+
+    @staticmethod
+    def _cached(cache, keys, compute):
+        """Looks keys up in cache and computes the missing ones once each, from their first position."""
+        cached = [cache.get(key) for key in keys]
+        missing = {}
+        for i, (key, value) in enumerate(zip(keys, cached)):
+            if value is None and key not in missing:
+                missing[key] = i
+        if missing:
+            # Cloned so a cached row does not keep its whole batch alive
+            computed = {key: value.clone() for key, value in zip(missing, compute(list(missing.values())))}
+            for key, value in computed.items():
+                cache.put(key, value)
+            cached = [value if value is not None else computed[key] for key, value in zip(keys, cached)]
+        return torch.stack(cached)
+
+    def _embed_images(self, images, image_keys):
+        if self.image_cache is None or image_keys is None:
+            return self.model.embed_images(images)
+        return self._cached(self.image_cache, image_keys, lambda index: self.model.embed_images(images[index]))
+
+    def _embed_questions(self, questions):
+        def compute(index):
+            ques_ids, ques_mask = tokenize_questions([questions[i] for i in index])
+            return self.model.embed_questions(torch.from_numpy(ques_ids), torch.from_numpy(ques_mask))
+
+        if self.question_cache is None:
+            return compute(range(len(questions)))
+        return self._cached(self.question_cache, questions, compute)
+
+    def _encode(self, images, questions, image_keys):
+        if isinstance(self.model, ExportedVQAModel):
+            ques_ids, ques_mask = tokenize_questions(questions)
+            return self.model.encode(images, torch.from_numpy(ques_ids), torch.from_numpy(ques_mask))
+        image_embedds = self._embed_images(images, image_keys)
+        ques_embedds = self._embed_questions(questions)
+        return self.model.attend(image_embedds, ques_embedds)
+
+    @torch.no_grad()
+    def predict(self, images, questions, image_keys=None):
+        """
+        :param images: uint8 tensor (batch, 3, 224, 224), as returned by load_image.
+        :param questions: List of question strings.
+        :param image_keys: Content hashes of the images, required by the image and result caches.
+        :return: List of answer strings.
+        """
+        questions = [normalize_question(question) for question in questions]
+        answers = [None] * len(questions)
+        use_results = self.result_cache is not None and image_keys is not None
+        if use_results:
+            answers = [self.result_cache.get((key, question)) for key, question in zip(image_keys, questions)]
+
+        todo = [i for i, answer in enumerate(answers) if answer is None]
+        if todo:
+            todo_keys = [image_keys[i] for i in todo] if image_keys is not None else None
+            with autocast(self.precision):
+                context = self._encode(images[todo], [questions[i] for i in todo], todo_keys)
+                tokens = self.model.generate_from_context(context, num_beams=self.num_beams)
+            # Drop the leading <s>
+            for i, answer in zip(todo, self.token_decoder.decode(tokens[:, 1:])):
+                answers[i] = answer
+                if use_results:
+                    self.result_cache.put((image_keys[i], questions[i]), answer)
+        return answers
@@ -0,0 +1,33 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+### Output projection fused with the loss, without materializing (batch, length, vocab) logits
+
+def _chunk_loss(hidden, weight, bias, targets, ignore_index):
+    logits = F.linear(hidden, weight, bias).float()
+    loss = F.cross_entropy(logits, targets, ignore_index=ignore_index, reduction='sum')
+    return loss, logits.argmax(dim=-1)
+
+def chunked_cross_entropy(hidden, linear, targets, ignore_index=1, chunk_size=1024):
+    """
+    Cross-entropy of linear(hidden) against targets, a chunk of positions at a time.
+    Each chunk's logits are recomputed during backward instead of being kept, so at most
+    chunk_size x vocab logits are alive at once.
+    :param hidden: Input of the output layer (batch, length, d_model).
+    :param linear: Output layer, e.g. VQAModel.mlp[-1].
+    :param targets: Target ids (batch, length).
+    :param chunk_size: Number of positions projected at once.
+    :return: Mean loss over the non-ignored targets, like CrossEntropyLoss, and the
+        argmax ids (batch, length).
+    """
+    flat_hidden = hidden.reshape(-1, hidden.size(-1))
+    flat_targets = targets.reshape(-1)
+    total = flat_hidden.new_zeros((), dtype=torch.float32)
+    predicted_ids = []
+    for start in range(0, flat_hidden.size(0), chunk_size):
+        loss, ids = checkpoint(_chunk_loss, flat_hidden[start:start + chunk_size], linear.weight, linear.bias,
+                               flat_targets[start:start + chunk_size], ignore_index, use_reentrant=False)
+        total = total + loss
+        predicted_ids.append(ids)
+    return total / (flat_targets != ignore_index).sum(), torch.cat(predicted_ids).view_as(targets)
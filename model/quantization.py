@@ -0,0 +1,40 @@
+import io
+import torch
+import torch.nn as nn
+
+### Int8 dynamic quantization of VQAModel for CPU inference
+
+QUANTIZE_MODES = ('none', 'int8', 'int8_deit')
+
+def quantize_model(model, mode='int8'):
+    """
+    Replaces the Linear and LSTM layers of an eval-mode VQAModel with dynamically quantized int8 ones
+    (int8 weights, activations quantized on the fly). CPU only.
+    :param mode: 'int8' quantizes PhoBERT, the LSTM, SAN, the decoder and the output head,
+        'int8_deit' also quantizes the Linear layers of the frozen DeiT backbone, 'none' does nothing.
+    :return: The same model, quantized in place.
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    if mode == 'none':
+        return model
+    if next(model.parameters()).device.type != 'cpu':
+        raise ValueError("Quantized models only run on CPU")
+
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+
+    names = ['ques_model', 'san_model', 'decoder', 'mlp']
+    if mode == 'int8_deit':
+        names.append('image_model')
+    for name in names:
+        torch.ao.quantization.quantize_dynamic(getattr(model, name), {nn.Linear, nn.LSTM},
+                                               dtype=torch.qint8, inplace=True)
+    model.quantized = mode
+    return model
+
+def model_size_mb(model):
+    """Serialized size of the model's weights, quantized or not."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
@@ -1,14 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.utils.data import DataLoader
-from utils.data_processing import preprocess_data
-from utils.ViTextVQA_dataset import ViTextVQA_Dataset
-from model.features_extraction import ImageEmbedding, QuesEmbedding
-from configs.arg_parser import get_args
-from configs.config import Config
-
-args = get_args()
+
 device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
 class StackAttention(nn.Module):
@@ -20,8 +13,17 @@ class StackAttention(nn.Module):
             self.dropout = nn.Dropout(p=0.5)
         self.ff_attention = nn.Linear(k, 1)
 
-    def forward(self, vi, vq):
+    def forward(self, vi, vq, image_index=None):
+        """
+        :param vi: Image patch features (images, patches, d).
+        :param vq: Question features (questions, 1, d).
+        :param image_index: Image of every question, when questions share images; the image
+            projection is computed once per image and gathered for its questions.
+        """
         hi = self.ff_image(vi)
+        if image_index is not None:
+            image_index = image_index.to(vi.device)
+            hi, vi = hi[image_index], vi[image_index]
         hq = self.ff_ques(vq)
         ha = F.tanh(hi + hq)
         if getattr(self, 'dropout'):
@@ -33,15 +35,23 @@ class StackAttention(nn.Module):
         return u
     
 if __name__=="__main__":
+    from torch.utils.data import DataLoader
+    from configs.arg_parser import get_args
+    from configs.config import Config
+    from utils.data_processing import preprocess_data
+    from utils.ViTextVQA_dataset import ViTextVQA_Dataset
+    from model.features_extraction import ImageEmbedding, QuesEmbedding
+
+    args = get_args()
     df_train, _, _ = preprocess_data(args)
-    train_vlsp_dataset = ViTextVQA_Dataset(df_train, transform=Config.transforms)
+    train_vlsp_dataset = ViTextVQA_Dataset(df_train, img_path=args.img_path, transform=Config.transforms)
     train_loader = DataLoader(train_vlsp_dataset, batch_size=args.batch_size, shuffle=True)
 
     image_model = ImageEmbedding().to(device)
     ques_model = QuesEmbedding(output_size=768).to(device)
 
     for batch in train_loader:
-        anno_ids, images, questions, answers = batch
+        anno_ids, images, questions, answers, ques_ids, ques_mask, _ = batch
         if torch.cuda.is_available():
             images = images.cuda()
             questions = questions
@@ -49,10 +59,10 @@ if __name__=="__main__":
         
         with torch.no_grad():
             image_embeddings, att_ids = image_model(images, image_ids=anno_ids)
-            ques_embeddings = ques_model(questions)
+            ques_embeddings = ques_model(ques_ids, ques_mask)
         break    
 
-    image_embeddings = image_embeddings.reshape(args.batch_size, 768, -1).permute(0, 2, 1)
+    image_embeddings = image_embeddings.reshape(image_embeddings.size(0), 768, -1).permute(0, 2, 1)
     ques_embeddings = ques_embeddings.unsqueeze(1)
     san_model = StackAttention(d=768, k=512, dropout=True).to(device)
 
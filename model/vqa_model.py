@@ -5,59 +5,211 @@ from model.features_extraction import ImageEmbedding, QuesEmbedding, AnsEmbeddin
 from model.sans import StackAttention
 from model.decoder_model import Decoder
 from configs.config import Config
-from configs.arg_parser import get_args
+from utils.profiling import StageTimer
 
-args = get_args()
 device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
+# PhoBERT special token ids
+BOS_ID = 0
+PAD_ID = 1
+EOS_ID = 2
+UNK_ID = 3
+
+def causal_mask(length):
+    mask = torch.full([length, length], float('-inf'))
+    return torch.triu(mask, diagonal=1).to(device)
+
 class VQAModel(nn.Module):
 
     def __init__(self, vocab_size=64001, output_size=768, d_model=768, 
                  num_heads=4, ffn_hidden=2048, drop_prob=0.1, num_layers=4, 
-                 num_att_layers=2, mode='train'):
+                 num_att_layers=2, mode='train', fused=False, answer_vocab=None):
+        """
+        :param answer_vocab: Sorted token ids the output head is restricted to (see build_answer_vocab),
+            None predicts over the whole PhoBERT vocabulary.
+        """
         super(VQAModel, self).__init__()
         self.mode = mode
+        # Per-stage timing of forward, replace with an enabled StageTimer to collect it
+        self.timer = StageTimer()
         self.image_model = ImageEmbedding().to(device)
         self.ques_model = QuesEmbedding(output_size=output_size).to(device)
-        self.ans_model = AnsEmbedding().to(device)
+        # Answer embeddings are tied to the question encoder's embedding table
+        self.ans_model = AnsEmbedding(embeddings=self.ques_model.phobert.embeddings).to(device)
         
         self.san_model = nn.ModuleList(
             [StackAttention(d=d_model, k=512, dropout=True)] * num_att_layers).to(device)
         
         self.decoder = Decoder(d_model, ffn_hidden, num_heads, 
-                               drop_prob, num_layers).to(device)
+                               drop_prob, num_layers, fused=fused).to(device)
 
         self.mlp = nn.Sequential(
             nn.Dropout(p=0.3),
             nn.Linear(d_model, d_model),
             nn.GELU(),
-            nn.Linear(d_model, vocab_size))
+            nn.Linear(d_model, vocab_size if answer_vocab is None else len(answer_vocab)))
+
+        self.register_buffer('answer_vocab', None)
+        if answer_vocab is not None:
+            # Head index -> token id, and token id -> head index with unseen tokens mapped to <unk>
+            answer_vocab = torch.as_tensor(answer_vocab, dtype=torch.long)
+            if not torch.equal(answer_vocab[:UNK_ID + 1], torch.arange(UNK_ID + 1)):
+                raise ValueError("answer_vocab must start with the special token ids 0-3")
+            token_to_head = torch.full((vocab_size,), UNK_ID, dtype=torch.long)
+            token_to_head[answer_vocab] = torch.arange(len(answer_vocab))
+            self.register_buffer('answer_vocab', answer_vocab.to(device))
+            self.register_buffer('token_to_head', token_to_head.to(device), persistent=False)
 
-    def forward(self, images, questions, answers, anno_ids, mask, 
-                mode, max_len=Config.MAX_LEN_ANS):
+    def to_head_ids(self, token_ids):
+        """Maps PhoBERT token ids to indices of the output head (identity without answer_vocab)."""
+        if self.answer_vocab is None:
+            return token_ids
+        return self.token_to_head[token_ids]
+
+    def to_token_ids(self, head_ids):
+        """Maps indices of the output head back to PhoBERT token ids."""
+        if self.answer_vocab is None:
+            return head_ids
+        return self.answer_vocab[head_ids]
+
+    def embed_images(self, images, anno_ids=None):
         image_embeddings, att_ids = self.image_model(images.to(device), image_ids=anno_ids)
-        if mode == 'train':
-            image_embedds = image_embeddings.reshape(args.batch_size, 768, -1).permute(0, 2, 1)
-        else:
-            image_embedds = image_embeddings.reshape(args.batch_size, 768, -1).permute(0, 2, 1)
-        
-        ques_embeddings = self.ques_model(questions)
-        ques_embedds = ques_embeddings.unsqueeze(1)
-        
+        return image_embeddings.reshape(image_embeddings.size(0), 768, -1).permute(0, 2, 1)
+
+    def embed_questions(self, ques_ids, ques_mask):
+        return self.ques_model(ques_ids, ques_mask).unsqueeze(1)
+
+    def attend(self, image_embedds, ques_embedds, image_index=None):
         for att_layer in self.san_model:
-            att_embedds = att_layer(image_embedds.to(device), ques_embedds.to(device))
+            att_embedds = att_layer(image_embedds.to(device), ques_embedds.to(device), image_index=image_index)
+        return att_embedds
+
+    def encode(self, images, ques_ids, ques_mask, anno_ids=None, image_index=None):
+        """
+        :param image_index: Position in images of every question's image (see group_images),
+            None when images holds one image per question.
+        """
+        with self.timer.stage('deit'):
+            image_embedds = self.embed_images(images, anno_ids)
+        with self.timer.stage('phobert'):
+            ques_embedds = self.embed_questions(ques_ids, ques_mask)
+        with self.timer.stage('san'):
+            return self.attend(image_embedds, ques_embedds, image_index)
+
+    def forward(self, images, ques_ids, ques_mask, ans_ids, anno_ids, mask, 
+                mode, return_hidden=False, image_index=None):
+        """
+        :param return_hidden: Return the input of the last mlp layer instead of the logits, for
+            chunked_cross_entropy.
+        :param image_index: Image of every question when images are shared, see encode.
+        :return: Logits (or hidden states) and the answer ids as indices of the output head.
+        """
+        att_embedds = self.encode(images, ques_ids, ques_mask, anno_ids, image_index)
         
-        ans_vocab, ans_embedds = self.ans_model(answers)
+        with self.timer.stage('answer_embedding'):
+            ans_vocab, ans_embedds = self.ans_model(ans_ids)
         
+        # Answers may be padded to the longest one in the batch rather than MAX_LEN_ANS
+        length = ans_embedds.size(1)
         x = ans_embedds # 16 * 48 * 768
-        y = att_embedds.to(device).unsqueeze(1).expand(-1, max_len, -1).to(device) # 16 * 768 -> 16 * 48 * 768
-        if mask == False:
-            out = self.decoder(x, y, mask=None).to(device)
+        y = att_embedds.to(device).unsqueeze(1).expand(-1, length, -1).to(device) # 16 * 768 -> 16 * 48 * 768
+        with self.timer.stage('decoder'):
+            if mask == False:
+                out = self.decoder(x, y, mask=None).to(device)
+            else:
+                mask = causal_mask(length)
+                # Position t only sees answer tokens up to t, so it can be trained to predict token t + 1
+                out = self.decoder(x, y, mask, cross_mask=mask).to(device)
+
+        ans_vocab = self.to_head_ids(ans_vocab)
+        with self.timer.stage('head'):
+            if return_hidden:
+                return self.mlp[:-1](out), ans_vocab
+            output_logits = self.mlp(out)
+        return output_logits, ans_vocab
+
+    @torch.no_grad()
+    def generate(self, images, ques_ids, ques_mask, anno_ids=None, max_len=Config.MAX_LEN_ANS,
+                 num_beams=1, use_cache=True, image_index=None):
+        """
+        Decodes answers from <s> to </s> without ground-truth answers. Call model.eval() first.
+        :return: Token ids (batch, length) starting with <s>, padded after </s>.
+        """
+        context = self.encode(images, ques_ids, ques_mask, anno_ids, image_index)
+        return self.generate_from_context(context, max_len=max_len, num_beams=num_beams, use_cache=use_cache)
+
+    @torch.no_grad()
+    def generate_from_context(self, context, max_len=Config.MAX_LEN_ANS, num_beams=1,
+                              use_cache=True, length_penalty=1.0):
+        if num_beams > 1:
+            tokens = self._beam_search(context, max_len, num_beams, use_cache, length_penalty)
         else:
-            mask = torch.full([max_len, max_len] , float('-inf'))
-            mask = torch.triu(mask, diagonal=1).to(device)
-        
-            out = self.decoder(x, y, mask).to(device)
+            tokens = self._greedy_search(context, max_len, use_cache)
+        return self.to_token_ids(tokens)
+
+    def _decode_step(self, context, tokens, cache):
+        # Log-probabilities of the token following the last one in tokens, both as head indices
+        length = tokens.size(1)
+        tokens = self.to_token_ids(tokens)
+        if cache is not None:
+            x = self.ans_model.embed(tokens[:, -1:], past_length=length - 1)
+            y = context.unsqueeze(1)
+            out = self.decoder(x, y, mask=None, cache=cache)
+        else:
+            x = self.ans_model.embed(tokens)
+            y = context.unsqueeze(1).expand(-1, length, -1)
+            mask = causal_mask(length)
+            out = self.decoder(x, y, mask, cross_mask=mask)
+        return F.log_softmax(self.mlp(out[:, -1]).float(), dim=-1)
+
+    def _greedy_search(self, context, max_len, use_cache):
+        batch_size = context.size(0)
+        tokens = torch.full((batch_size, 1), BOS_ID, dtype=torch.long, device=context.device)
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=context.device)
+        cache = self.decoder.init_cache() if use_cache else None
+
+        for _ in range(max_len - 1):
+            log_probs = self._decode_step(context, tokens, cache)
+            next_tokens = log_probs.argmax(dim=-1).masked_fill(finished, PAD_ID)
+            tokens = torch.cat([tokens, next_tokens.unsqueeze(1)], dim=1)
+            finished |= next_tokens == EOS_ID
+            if finished.all():
+                break
+        return tokens
+
+    def _beam_search(self, context, max_len, num_beams, use_cache, length_penalty):
+        batch_size = context.size(0)
+        context = context.repeat_interleave(num_beams, dim=0)
+        tokens = torch.full((batch_size * num_beams, 1), BOS_ID, dtype=torch.long, device=context.device)
+        finished = torch.zeros(batch_size * num_beams, dtype=torch.bool, device=context.device)
+        # Only the first beam is live at the start, otherwise all beams pick the same tokens
+        beam_scores = torch.full((batch_size, num_beams), float('-inf'), device=context.device)
+        beam_scores[:, 0] = 0.0
+        beam_scores = beam_scores.view(-1)
+        beam_offsets = (torch.arange(batch_size, device=context.device) * num_beams).unsqueeze(1)
+        cache = self.decoder.init_cache() if use_cache else None
+
+        for _ in range(max_len - 1):
+            log_probs = self._decode_step(context, tokens, cache)
+            vocab_size = log_probs.size(-1)
+            # Finished beams can only be extended with <pad>, at no cost
+            log_probs[finished] = float('-inf')
+            log_probs[finished, PAD_ID] = 0.0
+
+            scores = (beam_scores.unsqueeze(1) + log_probs).view(batch_size, num_beams * vocab_size)
+            top_scores, top_index = scores.topk(num_beams, dim=1)
+            origin = (beam_offsets + top_index // vocab_size).view(-1)
+            next_tokens = (top_index % vocab_size).view(-1)
+
+            tokens = torch.cat([tokens[origin], next_tokens.unsqueeze(1)], dim=1)
+            finished = finished[origin] | (next_tokens == EOS_ID)
+            beam_scores = top_scores.view(-1)
+            if cache is not None:
+                self.decoder.reorder_cache(cache, origin)
+            if finished.all():
+                break
 
-        output_logits = self.mlp(out)
-        return output_logits, ans_vocab
\ No newline at end of file
+        lengths = (tokens != PAD_ID).sum(dim=1).float()
+        normalized = (beam_scores / lengths ** length_penalty).view(batch_size, num_beams)
+        best = (beam_offsets.squeeze(1) + normalized.argmax(dim=1))
+        return tokens[best]
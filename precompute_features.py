@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from configs.arg_parser import get_args
+from configs.config import Config
+from utils.mmap_store import MmapStore
+from utils.data_processing import read_annotations
+from model.features_extraction import ImageEmbedding
+
+### Precompute frozen DeiT features and/or pre-resized images for every image in the train/dev/test CSVs
+
+device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+
+class ImageListDataset(Dataset):
+    def __init__(self, image_names, img_path, transform=None):
+        self.image_names = image_names
+        self.img_path = img_path
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.image_names)
+
+    def __getitem__(self, idx):
+        image_id = self.image_names[idx]
+        image_path = self.img_path + "/" + image_id
+        try:
+            image = Image.open(image_path).convert('RGB')
+        except FileNotFoundError:
+            raise ValueError(f"Image file not found: {image_path}")
+        if self.transform:
+            image = self.transform(image)
+        return image_id, image
+
+def collect_images(csv_paths):
+    image_names = set()
+    for csv_path in csv_paths:
+        image_names.update(read_annotations(csv_path, columns=['image'])['image'].astype(str))
+    return sorted(image_names)
+
+def resize_to_array(image, size=224):
+    # Same bilinear resize as Config.transforms, kept as uint8 HWC
+    return torch.from_numpy(np.asarray(image.resize((size, size), Image.BILINEAR)).copy())
+
+def precompute_images(image_names, img_path, shard_path, batch_size, num_workers=0):
+    dataset = ImageListDataset(image_names, img_path, transform=resize_to_array)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    store = MmapStore(shard_path, mode='w', keys=image_names, shape=(224, 224, 3), dtype=np.uint8)
+    for batch_idx, (image_ids, images) in enumerate(loader):
+        store.write(image_ids, images.numpy())
+        print(f"Batch [{batch_idx + 1}/{len(loader)}]")
+
+    store.close()
+    return store
+
+def precompute_features(image_model, image_names, img_path, feature_path, batch_size, num_workers=0):
+    # The store takes its shape from the first batch, there is nothing to write without images
+    if not image_names:
+        return None
+    dataset = ImageListDataset(image_names, img_path, transform=Config.transforms)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    store = None
+    image_model.eval()
+    for batch_idx, (image_ids, images) in enumerate(loader):
+        image_embeddings, _ = image_model(images.to(device), image_ids=image_ids)
+        image_embeddings = image_embeddings.cpu().numpy().astype(np.float16)
+        if store is None:
+            store = MmapStore(feature_path, mode='w', keys=image_names,
+                              shape=image_embeddings.shape[1:], dtype=np.float16)
+        store.write(image_ids, image_embeddings)
+        print(f"Batch [{batch_idx + 1}/{len(loader)}]")
+
+    store.close()
+    return store
+
+if __name__=="__main__":
+    args = get_args()
+    if args.feature_path is None and args.image_shard_path is None:
+        raise ValueError("--feature_path or --image_shard_path is required")
+
+    image_names = collect_images([args.train_csv_path, args.dev_csv_path, args.test_csv_path])
+    if args.image_shard_path is not None:
+        precompute_images(image_names, args.img_path, args.image_shard_path, 256, args.num_workers)
+        print(f"Saved {len(image_names)} resized images to {os.path.abspath(args.image_shard_path)}")
+    if args.feature_path is not None:
+        image_model = ImageEmbedding().to(device)
+        precompute_features(image_model, image_names, args.img_path, args.feature_path,
+                            args.batch_size, args.num_workers)
+        print(f"Saved features of {len(image_names)} images to {os.path.abspath(args.feature_path)}")
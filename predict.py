@@ -0,0 +1,165 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import torch
+from configs.arg_parser import get_args
+from model.inference import Predictor, image_key, load_image, load_serving_model
+from utils.lru_cache import make_cache
+from utils.data_processing import read_annotation_chunks
+
+### Stream predictions for every (image, question) row of a CSV to a JSONL or CSV file
+
+FIELDS = ["anno_id", "image", "question", "answer", "error"]
+DONE = object()
+
+def read_done_ids(output_path):
+    """
+    Returns the anno_ids already written, so a restarted run skips them.
+    A partially written last line, left by a crash, is cut off first.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as file:
+        data = file.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            file.truncate(end)
+    lines = data[:end].decode('utf-8').splitlines()
+    if output_path.endswith('.csv'):
+        return {row['anno_id'] for row in csv.DictReader(lines)}
+    return {json.loads(line)['anno_id'] for line in lines if line}
+
+def read_rows(csv_path, done_ids, task_queue, num_decoders, errors, chunksize=10000):
+    try:
+        for chunk in read_annotation_chunks(csv_path, columns=['anno_id', 'image', 'question'], chunksize=chunksize,
+                                            dtype={'anno_id': str}):
+            for anno_id, image, question in zip(chunk['anno_id'], chunk['image'], chunk['question']):
+                if anno_id not in done_ids:
+                    task_queue.put((anno_id, image, str(question)))
+    except Exception as e:
+        # Re-raised by predict_csv once the pipeline has drained
+        errors.append(e)
+    finally:
+        for _ in range(num_decoders):
+            task_queue.put(DONE)
+
+def decode_images(img_path, task_queue, sample_queue, errors):
+    try:
+        while True:
+            task = task_queue.get()
+            if task is DONE:
+                return
+            anno_id, image_id, question = task
+            try:
+                with open(img_path + "/" + image_id, 'rb') as file:
+                    image_bytes = file.read()
+                sample = (anno_id, image_id, question, load_image(image_bytes), image_key(image_bytes), None)
+            except Exception as e:
+                # A bad image (missing, truncated, decompression bomb, ...) only fails its own row
+                sample = (anno_id, image_id, question, None, None, f"{type(e).__name__}: {e}")
+            sample_queue.put(sample)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        sample_queue.put(DONE)
+
+def write_results(output_path, write_queue, errors):
+    try:
+        is_csv = output_path.endswith('.csv')
+        new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        with open(output_path, 'a', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS) if is_csv else None
+            if is_csv and new_file:
+                writer.writeheader()
+            while True:
+                records = write_queue.get()
+                if records is DONE:
+                    return
+                for record in records:
+                    if is_csv:
+                        writer.writerow(record)
+                    else:
+                        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                # Flushed per batch so a crash loses at most the batch being written
+                file.flush()
+    except Exception as e:
+        errors.append(e)
+        # Keep taking batches so the main thread never blocks on a full queue
+        while write_queue.get() is not DONE:
+            pass
+
+def predict_csv(predictor, csv_path, img_path, output_path, batch_size, num_decoders=4, queue_size=64):
+    done_ids = read_done_ids(output_path)
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} rows already in {output_path}")
+
+    task_queue = queue.Queue(maxsize=queue_size)
+    sample_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=4)
+    # Exceptions of the worker threads, each of them still signals DONE when it fails
+    errors = []
+    threads = [threading.Thread(target=read_rows, args=(csv_path, done_ids, task_queue, num_decoders, errors),
+                                daemon=True),
+               threading.Thread(target=write_results, args=(output_path, write_queue, errors), daemon=True)]
+    threads += [threading.Thread(target=decode_images, args=(img_path, task_queue, sample_queue, errors), daemon=True)
+                for _ in range(num_decoders)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    num_rows, num_batches, running = 0, 0, num_decoders
+    while running > 0:
+        # Take what is ready, up to batch_size, blocking only for the first sample
+        batch = []
+        while running > 0 and len(batch) < batch_size:
+            try:
+                sample = sample_queue.get(block=not batch)
+            except queue.Empty:
+                break
+            if sample is DONE:
+                running -= 1
+            else:
+                batch.append(sample)
+        if not batch:
+            continue
+
+        records = [{"anno_id": anno_id, "image": image_id, "question": question, "answer": "", "error": error}
+                   for anno_id, image_id, question, _, _, error in batch]
+        valid = [i for i, sample in enumerate(batch) if sample[3] is not None]
+        if valid:
+            images = torch.stack([batch[i][3] for i in valid])
+            answers = predictor.predict(images, [batch[i][2] for i in valid], [batch[i][4] for i in valid])
+            for i, answer in zip(valid, answers):
+                records[i]["answer"] = answer
+        write_queue.put(records)
+
+        num_rows += len(batch)
+        num_batches += 1
+        if num_batches % 50 == 0:
+            print(f"{num_rows} rows, {num_rows / (time.perf_counter() - start):.1f} rows/sec")
+
+    write_queue.put(DONE)
+    threads[1].join()
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - start
+    print(f"Predicted {num_rows} rows in {elapsed:.1f} s ({num_rows / max(elapsed, 1e-9):.1f} rows/sec)")
+    for name, stats in predictor.cache_stats().items():
+        print(f"{name} cache: {stats}")
+    return num_rows
+
+if __name__=="__main__":
+    args = get_args()
+    csv_path = args.input_csv or args.test_csv_path
+    output_path = args.output_path or os.path.join(args.model_path, 'predictions.jsonl')
+
+    model = load_serving_model(args)
+    predictor = Predictor(model, num_beams=args.num_beams, precision=args.precision,
+                          question_cache=make_cache(args.question_cache_mb),
+                          image_cache=make_cache(args.image_cache_mb),
+                          result_cache=make_cache(args.result_cache_mb))
+    predict_csv(predictor, csv_path, args.img_path, output_path, args.batch_size,
+                num_decoders=max(1, args.num_workers or 1), queue_size=args.queue_size)
@@ -0,0 +1,145 @@
+import asyncio
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from configs.arg_parser import get_args
+from model.inference import Predictor, image_key, load_image, load_serving_model
+from utils.latency import LatencyStats
+from utils.lru_cache import make_cache
+
+### Local HTTP inference server batching concurrent requests
+#   POST /predict  {"image": "<base64 encoded image>", "question": "..."} -> {"answer": "..."}
+#   GET  /metrics  latency percentiles, batch-size histogram and cache hit/miss counters
+
+class DynamicBatcher:
+    """
+    Collects concurrent requests into micro-batches of at most max_batch_size,
+    waiting at most max_wait_ms after the first request of a batch.
+    Batches run one at a time on a dedicated thread, so requests queue up while the model is busy.
+    """
+
+    def __init__(self, predictor, max_batch_size=8, max_wait_ms=10, stats=None):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or LatencyStats()
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, image, question, key=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, question, key, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            questions = [question for _, question, _, _ in batch]
+            keys = [key for _, _, key, _ in batch]
+            self.stats.add_batch(len(batch))
+            try:
+                images = torch.stack([image for image, _, _, _ in batch])
+                answers = await loop.run_in_executor(self.executor, self.predictor.predict, images, questions, keys)
+            except Exception as e:
+                # Fail every request of the batch (e.g. CUDA OOM), the batcher keeps serving the next ones
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, _, future), answer in zip(batch, answers):
+                if not future.done():
+                    future.set_result(answer)
+
+class VQAServer:
+    def __init__(self, batcher, decode_workers=4):
+        self.batcher = batcher
+        self.stats = batcher.stats
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+
+    async def handle_predict(self, body):
+        request = json.loads(body)
+        image_bytes = base64.b64decode(request["image"])
+        image = await asyncio.get_running_loop().run_in_executor(self.decode_executor, load_image, image_bytes)
+        answer = await self.batcher.submit(image, str(request["question"]), image_key(image_bytes))
+        return {"answer": answer}
+
+    async def handle(self, method, path, body):
+        if method == "POST" and path == "/predict":
+            start = time.perf_counter()
+            try:
+                result = await self.handle_predict(body)
+            except (KeyError, ValueError, OSError) as e:
+                return 400, {"error": f"Invalid request: {e}"}
+            except Exception as e:
+                return 500, {"error": f"Prediction failed: {type(e).__name__}: {e}"}
+            self.stats.add_latency((time.perf_counter() - start) * 1000)
+            return 200, result
+        if method == "GET" and path == "/metrics":
+            return 200, dict(self.stats.summary(), caches=self.batcher.predictor.cache_stats())
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        return 404, {"error": f"Not found: {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive: request line, headers, Content-Length body
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, result = await self.handle(method, path, body)
+                payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode('latin-1') + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(predictor, host, port, max_batch_size, max_wait_ms, decode_workers):
+    batcher = DynamicBatcher(predictor, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    server = VQAServer(batcher, decode_workers=decode_workers)
+    batch_task = asyncio.create_task(batcher.run())
+    async with await asyncio.start_server(server.handle_connection, host, port) as http_server:
+        print(f"Serving on http://{host}:{port} (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+        try:
+            await http_server.serve_forever()
+        finally:
+            batch_task.cancel()
+
+if __name__=="__main__":
+    args = get_args()
+    model = load_serving_model(args)
+    predictor = Predictor(model, num_beams=args.num_beams, precision=args.precision,
+                          question_cache=make_cache(args.question_cache_mb),
+                          image_cache=make_cache(args.image_cache_mb),
+                          result_cache=make_cache(args.result_cache_mb))
+    asyncio.run(serve(predictor, args.host, args.port, args.max_batch_size, args.max_wait_ms,
+                      max(1, args.num_workers or 1)))
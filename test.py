@@ -1,76 +1,80 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-from transformers import AutoTokenizer
-from utils.metrics import compute_em_and_f1
+from utils.metrics import EMF1Accumulator
 from configs.arg_parser import get_args
 from configs.config import Config
 from utils.data_processing import preprocess_data
-from utils.ViTextVQA_dataset import ViTextVQA_Dataset
-from model.vqa_model import VQAModel
+from utils.ViTextVQA_dataset import ViTextVQA_Dataset, make_batched_dataloader
+from utils.mmap_store import MmapStore
+from model.execution import autocast
+from model.inference import load_vqa_model
+from utils.profiling import StageTimer
 
-args = get_args()
 device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
-def evaluation(model, test_loader, criterion, vocab_swap, device):
+def evaluation(model, test_loader, criterion, device, generate=False, num_beams=1, precision='fp32', timer=None):
+    """
+    :param timer: StageTimer, an enabled one prints per-stage timings at the end.
+    """
     model.eval()
     total_loss = 0.0
-    total_em = 0.0
-    total_f1 = 0.0
+    metrics = EMF1Accumulator()
+    timer = timer if timer is not None else StageTimer()
+    model.timer = timer
 
     with torch.no_grad():
-        for batch_idx, batch in enumerate(test_loader):
-            anno_id, images, questions, answers = batch
-            if len(images) == args.batch_size:
-                predicted_tokens, ans_embedds = model(images.to(device), questions, answers, anno_id, mode='train', mask=True)
-                predicted_tokens = predicted_tokens.float()
-                ans_embedds = ans_embedds.long()
-
-                # Prepare references and hypotheses
-                references = [answer.split() for answer in answers]
-                hypotheses = []
-                for i in range(args.batch_size):
-                    sentence_predicted = torch.argmax(predicted_tokens[i], axis=1)
-                    predicted_sentence = []
-                    for idx in sentence_predicted:
-                        if idx == 2:  # End of Sentence Token
-                            break
-                        word = vocab_swap[idx.item()]
-                        
-                        if word in {"<pad>", "<s>", "</s>", ""}:
-                            continue
-                        predicted_sentence.append(word)
-                        
-                
-                    predicted_sentence = ' '.join(predicted_sentence).strip()
-                    hypotheses.append(predicted_sentence.split())
-
-                em_score, f1_score = compute_em_and_f1(references, hypotheses)
-                total_em += em_score
-                total_f1 += f1_score
+        for batch_idx, batch in enumerate(timer.iterate(test_loader)):
+            anno_id, images, questions, answers, ques_ids, ques_mask, ans_ids = batch[:7]
+            # Batches from group_images also hold the image of every question
+            image_index = batch[7] if len(batch) > 7 else None
+            with timer.stage('forward'), autocast(precision):
+                predicted_tokens, ans_embedds = model(images.to(device, non_blocking=True), ques_ids, ques_mask, ans_ids, anno_id, mode='train', mask=True,
+                                                      image_index=image_index)
+            # Position t predicts answer token t + 1
+            predicted_tokens = predicted_tokens[:, :-1].float()
+            ans_embedds = ans_embedds[:, 1:].long()
 
+            if generate:
+                # Decode without the ground-truth answers, dropping the leading <s>
+                with timer.stage('generate'), autocast(precision):
+                    predictions = model.generate(images.to(device, non_blocking=True), ques_ids, ques_mask, anno_id, num_beams=num_beams,
+                                                 image_index=image_index)[:, 1:]
+                # Same ids as the references, which index the output head
+                predictions = model.to_head_ids(predictions)
+            else:
+                predictions = predicted_tokens
+            with timer.stage('metrics'):
+                metrics.update(predictions, ans_embedds)
                 total_loss += criterion(predicted_tokens.permute(0, 2, 1), ans_embedds).item()
+            timer.step(len(anno_id))
 
     avg_loss = total_loss / len(test_loader)
-    avg_em = total_em / len(test_loader)
-    avg_f1 = total_f1 / len(test_loader)
+    metrics.all_reduce()
+    avg_em, avg_f1 = metrics.compute()
+    print(f"Throughput: {timer.summary()}")
 
     return avg_loss, avg_em, avg_f1
 
 if __name__=="__main__":
-    tokenizer = AutoTokenizer.from_pretrained(Config.textmodel_dir)
-    vocab = tokenizer.get_vocab()
-    vocab_swap = {value: key for key, value in vocab.items()}
+    args = get_args()
+    if args.quantize != 'none' and args.precision != 'fp32':
+        raise ValueError(f"Quantized models run in fp32, got precision {args.precision}")
 
     _, df_dev, _ = preprocess_data(args)
-    test_vitextvqa_dataset = ViTextVQA_Dataset(df_dev, transform=Config.transforms)
-    test_loader = DataLoader(test_vitextvqa_dataset, batch_size=args.batch_size, shuffle=True)
+    feature_store = MmapStore(args.feature_path) if args.feature_path else None
+    image_store = MmapStore(args.image_shard_path) if args.image_shard_path else None
+    test_vitextvqa_dataset = ViTextVQA_Dataset(df_dev, img_path=args.img_path, transform=Config.transforms,
+                                    feature_store=feature_store, image_store=image_store,
+                                    pretokenize=args.pretokenize)
+    test_loader = make_batched_dataloader(test_vitextvqa_dataset, args, shuffle=True)
 
-    model = VQAModel().to(device)
-    model.load_state_dict(torch.load(args.model_path + "/" + 'vi_text.pt'))
+    model = load_vqa_model(args.model_path + "/" + 'vi_text.pt', fused=args.fused, compile=args.compile,
+                           quantize=args.quantize)
     criterion = nn.CrossEntropyLoss(ignore_index=1)
 
-    _, test_em, test_f1 = evaluation(model, test_loader, criterion, vocab_swap, device)
+    _, test_em, test_f1 = evaluation(model, test_loader, criterion, device,
+                                     generate=args.generate, num_beams=args.num_beams, precision=args.precision,
+                                     timer=StageTimer(enabled=args.timing))
 
     print(f"Test EM: {test_em:.4f}")
     print(f"Test F1_SCORE: {test_f1:.4f}")
\ No newline at end of file
@@ -0,0 +1,35 @@
+import io
+import json
+import pytest
+from utils.json_to_parquet import JsonStream, convert_file, iter_annotations
+
+DOCUMENT = {"version": 12.5, "ratio": -3.25E+2, "eps": 1e-5, "count": 7,
+            "images": [{"id": 1, "size": [0.5, 2e3]}],
+            "annotations": [{"id": 10, "image_id": 1, "question": "biển số xe là gì?", "answers": ["51g 123.45"]},
+                            {"id": 11, "image_id": 2, "question": "có bao nhiêu người?", "answers": ["2", "hai"]}]}
+ROWS = [(10, "1.jpg", "biển số xe là gì?", "51g 123.45"), (11, "2.jpg", "có bao nhiêu người?", "2, hai")]
+
+@pytest.fixture
+def json_path(tmp_path):
+    path = tmp_path / "annotations.json"
+    path.write_text(json.dumps(DOCUMENT, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+@pytest.mark.parametrize("block_size", range(1, 9))
+def test_numbers_cut_at_block_boundary(block_size):
+    stream = JsonStream(io.StringIO('{"version": 12.5, "eps": 1e-5, "ratio": -3.25E+2, "annotations": []}'), block_size)
+    assert list(stream.fields("annotations")) == []
+    for text in ("12.5", "1e-5", "-3.25E+2", "[0.5, 2e3, 7]"):
+        assert JsonStream(io.StringIO(text), block_size).value() == json.loads(text)
+
+@pytest.mark.parametrize("block_size", range(1, 9))
+def test_iter_annotations_block_sizes(json_path, block_size):
+    assert list(iter_annotations(json_path, block_size)) == ROWS
+
+@pytest.mark.parametrize("block_size", [1, 3, 5, 1 << 20])
+def test_convert_file_block_sizes(json_path, tmp_path, block_size):
+    pq = pytest.importorskip("pyarrow.parquet")
+    parquet_path = str(tmp_path / "annotations.parquet")
+    assert convert_file(json_path, parquet_path, row_group_size=1, block_size=block_size) == len(ROWS)
+    table = pq.read_table(parquet_path).to_pydict()
+    assert list(zip(*(table[name] for name in ("anno_id", "image", "question", "answer")))) == ROWS
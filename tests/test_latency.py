@@ -0,0 +1,12 @@
+from utils.latency import percentile
+
+def test_percentile_nearest_rank():
+    assert percentile(list(range(1, 6)), 50) == 3
+    assert percentile(list(range(1, 10)), 50) == 5
+    assert percentile(list(range(1, 151)), 99) == 149
+
+def test_percentile_bounds():
+    assert percentile([], 50) == 0.0
+    assert percentile([7.0], 99) == 7.0
+    assert percentile([3, 1, 2], 0) == 1
+    assert percentile([3, 1, 2], 100) == 3
@@ -1,130 +1,238 @@
-import matplotlib.pyplot as plt
+import contextlib
+import math
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-from transformers import AutoTokenizer, get_linear_schedule_with_warmup
+from transformers import get_linear_schedule_with_warmup
 import torch.optim as optim
-from utils.metrics import normalize_text, compute_em_and_f1
+from utils.metrics import EMF1Accumulator
 from configs.arg_parser import get_args
 from configs.config import Config
 from utils.data_processing import preprocess_data
-from utils.ViTextVQA_dataset import ViTextVQA_Dataset
+from utils.ViTextVQA_dataset import ViTextVQA_Dataset, make_batched_dataloader, build_answer_vocab
+from utils.mmap_store import MmapStore
+from utils.decoding import TokenDecoder
+from utils.samplers import ResumableDistributedSampler, set_loader_epoch
+from utils.distributed import (init_distributed, cleanup_distributed, is_main_process, print_main,
+                               all_reduce_mean, unwrap_model, main_process_first)
+from utils.profiling import StageTimer, trace_profiler
+from utils.checkpoint import CheckpointManager, training_state, restore_training_state
 from model.vqa_model import VQAModel
+from model.losses import chunked_cross_entropy
+from model.execution import autocast, apply_execution_mode
+from model.backbones import get_tokenizer
 
 ### Train model
 
-args = get_args()
 device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
-def train(model, train_loader, num_epochs, optimizer, scheduler, criterion, vocab_swap, device):
-    print_every = 2000
+def train(model, train_loader, num_epochs, optimizer, scheduler, criterion, token_decoder, device, precision='fp32',
+          checkpoints=None, save_every=0, resume_state=None, grad_accum_steps=1,
+          loss_chunk_size=0, log_every=2000, timer=None, profiler=None):
+    """
+    :param model: VQAModel, or a DistributedDataParallel wrapping one.
+    :param checkpoints: CheckpointManager, None disables checkpointing (pass it on rank 0 only).
+    :param save_every: Optimizer steps between checkpoints, a checkpoint is also saved after each epoch.
+    :param resume_state: Training state loaded from a checkpoint to continue from.
+    :param grad_accum_steps: Batches whose gradients are averaged into each optimizer step.
+    :param loss_chunk_size: Positions per chunk of chunked_cross_entropy, 0 computes the full logits.
+    :param log_every: Batches between progress logs.
+    :param timer: StageTimer, an enabled one adds per-stage timings to the logs.
+    :param profiler: Entered trace_profiler, stepped after every batch.
+    """
+    if grad_accum_steps < 1:
+        raise ValueError(f"grad_accum_steps must be at least 1, got {grad_accum_steps}")
+    timer = timer if timer is not None else StageTimer()
+    profiler = profiler if profiler is not None else trace_profiler()
     
-    losses = []
-    em_scores = []
-    f1_scores = []
+    history = {'losses': [], 'em_scores': [], 'f1_scores': []}
+    start_epoch, start_batch, step = 0, 0, 0
+    if resume_state is not None:
+        history = resume_state['history']
+        start_epoch, start_batch, step = resume_state['epoch'], resume_state['batch'], resume_state['step']
+    losses = history['losses']
+    em_scores = history['em_scores']
+    f1_scores = history['f1_scores']
     
-    for epoch in range(num_epochs):
+    vqa_model = unwrap_model(model)
+    vqa_model.timer = timer
+    metrics = EMF1Accumulator()
+    for epoch in range(start_epoch, num_epochs):
         model.train()
         total_loss = 0.0
-        total_em = 0.0
-        total_f1 = 0.0
+        metrics.reset()
+        skip = 0
+        if epoch == start_epoch and start_batch > 0:
+            skip = start_batch
+            # Saved totals are global, they are restored on a single process so the sum stays right
+            if resume_state['metrics'] is not None and is_main_process():
+                metrics.totals = resume_state['metrics'].to(device)
+        # Same order as the interrupted run, without the batches it already trained on
+        if not set_loader_epoch(train_loader, epoch, skip) and skip:
+            raise ValueError("Resuming mid-epoch needs a ResumableDistributedSampler or LengthBucketBatchSampler")
+        num_batches = skip + len(train_loader)
+        timer.reset()
         
-        for batch_idx, batch in enumerate(train_loader):
-            anno_id, images, questions, answers = batch
-            if len(images) == args.batch_size:
-                predicted_tokens, ans_embedds = model(images.to(device), questions, answers, anno_id, mode='train', mask=True)
-                predicted_tokens = predicted_tokens.float()
-                ans_embedds = ans_embedds.long()
-                
-                # Prepare references and hypotheses
-                references = [normalize_text(answer).split() for answer in answers]
-                hypotheses = []
-                for i in range(args.batch_size):
-                    sentence_predicted = torch.argmax(predicted_tokens[i], axis=1)
-                    predicted_sentence = []
-                    for idx in sentence_predicted:
-                        if idx == 2:  # End of Sentence Token
-                            break
-                        word = vocab_swap.get(idx.item(), "")  # Handle out-of-vocabulary gracefully
-                        if word in {"<pad>", "<s>", "</s>", ""}:
-                            continue
-                        predicted_sentence.append(word)
-                        
-                    predicted_sentence = ' '.join(predicted_sentence).strip()
-                    hypotheses.append(predicted_sentence.split())
-                
-                # Compute EM and F1 scores
-                em_score, f1_score = compute_em_and_f1(references, hypotheses)
-                total_em += em_score
-                total_f1 += f1_score
-                
-                if (batch_idx + 1) % print_every == 0:
-                    print(f"Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(train_loader)}], Loss: {loss.item():.4f}")
-                    print(f"Exact Match (EM): {em_score:.4f}")
-                    print(f"F1 Score: {f1_score:.4f}")
-                    
-                    for i in range(args.batch_size):
-                        sentence_predicted = torch.argmax(predicted_tokens[i], axis=1)
-                        predicted_sentence = []
-                        for idx in sentence_predicted:
-                            if idx == 2:
-                                break
-                            word = vocab_swap.get(idx.item(), "")
-                            if word in {"<pad>", "<s>", "</s>", ""}:
-                                continue
-                            predicted_sentence.append(word)
-                            
-                        predicted_sentence = ' '.join(predicted_sentence).strip()
+        for batch_idx, batch in enumerate(timer.iterate(train_loader), start=skip):
+            anno_id, images, questions, answers, ques_ids, ques_mask, ans_ids = batch[:7]
+            # Average over the batches of the accumulation window, the last one may be shorter
+            window_start = batch_idx // grad_accum_steps * grad_accum_steps
+            window = min(grad_accum_steps, num_batches - window_start)
+            last_in_window = batch_idx + 1 == window_start + window
+            # Gradients are only all-reduced between processes on the last batch of the window
+            sync = contextlib.nullcontext() if last_in_window or not hasattr(model, 'no_sync') else model.no_sync()
+
+            with sync:
+                with timer.stage('forward'):
+                    loss, predicted_ids, ans_embedds = training_step(model, batch, criterion, precision, loss_chunk_size)
+                if batch_idx == window_start:
+                    optimizer.zero_grad()
+                with timer.stage('backward'):
+                    (loss / window).backward()
+
+            # Accumulate EM and F1 scores on token ids
+            with timer.stage('metrics'):
+                metrics.update(predicted_ids, ans_embedds)
+                total_loss += loss.item()
+                losses.append(loss.item())
+
+            if last_in_window:
+                with timer.stage('optimizer'):
+                    optimizer.step()
+                    scheduler.step()
+                step += 1
+
+                if save_every and step % save_every == 0:
+                    with timer.stage('checkpoint'):
+                        # Every process takes part in reducing the metrics, only the one holding checkpoints saves
+                        global_metrics = metrics.reduced()
+                        if checkpoints is not None:
+                            checkpoints.save(step, training_state(vqa_model, optimizer, scheduler, epoch, batch_idx + 1,
+                                                                  step, history, global_metrics))
+            timer.step(len(anno_id))
+            profiler.step()
+
+            if (batch_idx + 1) % log_every == 0:
+                em_score, f1_score = metrics.reduced().compute()
+                avg_loss = all_reduce_mean(total_loss / (batch_idx + 1 - skip))
+                print_main(f"Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{num_batches}], Loss: {avg_loss:.4f}")
+                print_main(f"Exact Match (EM): {em_score:.4f}")
+                print_main(f"F1 Score: {f1_score:.4f}")
+                print_main(f"Throughput: {timer.summary()}")
+
+                if is_main_process():
+                    with timer.stage('decode'):
+                        predicted_sentences = token_decoder.decode(vqa_model.to_token_ids(predicted_ids))
+                    for i in range(len(answers)):
                         print(f"Question: {questions[i]}")
                         print(f"Answer: {answers[i]}")
-                        print(f"Answer Prediction: {predicted_sentence}")
+                        print(f"Answer Prediction: {predicted_sentences[i]}")
                     print("\n")
-                
-                # Compute loss and update model
-                loss = criterion(predicted_tokens.permute(0, 2, 1), ans_embedds)
-                valid_indicies = torch.where(ans_embedds == 1, False, True)
-                loss = loss.sum() / valid_indicies.sum()
-                
-                optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
-                scheduler.step()
-                total_loss += loss.item()
-                losses.append(loss.item())
         
-        avg_em = total_em / len(train_loader)
-        avg_f1 = total_f1 / len(train_loader)
+        metrics.all_reduce()
+        avg_em, avg_f1 = metrics.compute()
+        avg_loss = all_reduce_mean(total_loss / max(num_batches - skip, 1))
         
         em_scores.append(avg_em)
         f1_scores.append(avg_f1)
         
-        print(f"Epoch [{epoch + 1}/{num_epochs}]")
-        print(f"Average Exact Match (EM): {avg_em:.4f}")
-        print(f"Average F1 Score: {avg_f1:.4f}")
-        print("\n")
+        print_main(f"Epoch [{epoch + 1}/{num_epochs}]")
+        print_main(f"Average Loss: {avg_loss:.4f}")
+        print_main(f"Average Exact Match (EM): {avg_em:.4f}")
+        print_main(f"Average F1 Score: {avg_f1:.4f}")
+        print_main("\n")
+
+        if checkpoints is not None:
+            checkpoints.save(step, training_state(vqa_model, optimizer, scheduler, epoch + 1, 0, step, history))
     
+    if checkpoints is not None:
+        checkpoints.wait()
     return losses, em_scores, f1_scores
 
+def training_step(model, batch, criterion, precision='fp32', loss_chunk_size=0):
+    """
+    Forward pass and loss of one batch.
+    :return: Tuple (loss, predicted ids, target ids), ids are indices of the output head.
+    """
+    anno_id, images, questions, answers, ques_ids, ques_mask, ans_ids = batch[:7]
+    # Batches from group_images also hold the image of every question
+    image_index = batch[7] if len(batch) > 7 else None
+    with autocast(precision):
+        outputs, ans_embedds = model(images.to(device, non_blocking=True), ques_ids, ques_mask, ans_ids, anno_id,
+                                     mode='train', mask=True, return_hidden=loss_chunk_size > 0,
+                                     image_index=image_index)
+    # Position t predicts answer token t + 1
+    ans_embedds = ans_embedds[:, 1:].long()
+
+    with unwrap_model(model).timer.stage('loss'):
+        if loss_chunk_size:
+            # Projection and loss a chunk of positions at a time, the full logits are never stored
+            with autocast(precision):
+                loss, predicted_ids = chunked_cross_entropy(outputs[:, :-1], unwrap_model(model).mlp[-1], ans_embedds,
+                                                            ignore_index=criterion.ignore_index,
+                                                            chunk_size=loss_chunk_size)
+        else:
+            predicted_tokens = outputs[:, :-1].float()
+            predicted_ids = predicted_tokens.detach().argmax(dim=-1)
+            loss = criterion(predicted_tokens.permute(0, 2, 1), ans_embedds)
+
+        valid_indicies = torch.where(ans_embedds == 1, False, True)
+        loss = loss.sum() / valid_indicies.sum()
+    return loss, predicted_ids, ans_embedds
+
 if __name__=="__main__":
-    tokenizer = AutoTokenizer.from_pretrained(Config.textmodel_dir)
-    vocab = tokenizer.get_vocab()
-    vocab_swap = {value: key for key, value in vocab.items()}
+    args = get_args()
+    # Single process unless launched by torchrun
+    rank, world_size = init_distributed(args.dist_backend)
+    token_decoder = TokenDecoder(get_tokenizer())
 
-    df_train, _, _ = preprocess_data(args)
-    train_vlsp_dataset = ViTextVQA_Dataset(df_train, transform=Config.transforms)
-    train_loader = DataLoader(train_vlsp_dataset, batch_size=args.batch_size, shuffle=True)
+    with main_process_first():
+        df_train, _, _ = preprocess_data(args)
+    feature_store = MmapStore(args.feature_path) if args.feature_path else None
+    image_store = MmapStore(args.image_shard_path) if args.image_shard_path else None
+    train_vlsp_dataset = ViTextVQA_Dataset(df_train, img_path=args.img_path, transform=Config.transforms,
+                                    feature_store=feature_store, image_store=image_store,
+                                    pretokenize=args.pretokenize)
+    # Each process trains on its own 1 / world_size of every epoch
+    train_loader = make_batched_dataloader(train_vlsp_dataset, args,
+                                           sampler=ResumableDistributedSampler(train_vlsp_dataset))
 
     num_epochs = args.epochs
-    model = VQAModel().to(device)
+    answer_vocab = build_answer_vocab(df_train['answer']) if args.answer_vocab else None
+    model = VQAModel(answer_vocab=answer_vocab).to(device)
+    apply_execution_mode(model, fused=args.fused, compile=args.compile, checkpointing=args.activation_checkpointing)
     criterion = nn.CrossEntropyLoss(ignore_index=1)
     optimizer = optim.AdamW(model.parameters(), Config.lr)
     scheduler = get_linear_schedule_with_warmup(
         optimizer, 
         num_warmup_steps=0, 
-        num_training_steps=int(len(train_loader) * args.epochs)
+        num_training_steps=math.ceil(len(train_loader) / args.grad_accum_steps) * args.epochs
     )
-    losses, em_scores, f1_scores = train(model, train_loader, num_epochs, optimizer, scheduler, criterion, vocab_swap, device)
 
+    checkpoints = CheckpointManager(args.checkpoint_dir or args.model_path + "/checkpoints", keep_last=args.keep_last)
+    resume_state = None
+    if args.resume:
+        # Every process restores the same state, before DistributedDataParallel broadcasts rank 0's weights
+        resume_state = checkpoints.load()
+        restore_training_state(resume_state, model, optimizer, scheduler)
+        print_main(f"Resuming from epoch {resume_state['epoch'] + 1}, batch {resume_state['batch']} (step {resume_state['step']})")
+    if world_size > 1:
+        model = nn.parallel.DistributedDataParallel(model, device_ids=[torch.cuda.current_device()] if device.type == 'cuda' else None)
+        print_main(f"Training on {world_size} processes ({args.dist_backend})")
+    with trace_profiler(args.profile_dir, wait=args.profile_wait, active=args.profile_active,
+                        worker_name=f"rank{rank}") as profiler:
+        losses, em_scores, f1_scores = train(model, train_loader, num_epochs, optimizer, scheduler, criterion, token_decoder, device,
+                                             precision=args.precision, checkpoints=checkpoints if is_main_process() else None,
+                                             save_every=args.save_every, resume_state=resume_state,
+                                             grad_accum_steps=args.grad_accum_steps, loss_chunk_size=args.loss_chunk_size,
+                                             log_every=args.log_every, timer=StageTimer(enabled=args.timing),
+                                             profiler=profiler)
+    checkpoints.close()
+    model = unwrap_model(model)
+    cleanup_distributed()
+    if rank != 0:
+        raise SystemExit(0)
+
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 6))
     plt.plot(em_scores, label='EM', marker='o')
     plt.plot(f1_scores, label='F1_SCORE', marker='o')
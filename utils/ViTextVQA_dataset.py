@@ -1,37 +1,120 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import torch
 from PIL import Image
-from transformers import AutoTokenizer
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, default_collate
 from configs.config import Config
-from configs.arg_parser import get_args
-from utils.data_processing import preprocess_data
+from model.backbones import get_tokenizer
+from utils.samplers import LengthBucketBatchSampler, ImageGroupedBatchSampler
 
-args = get_args()
-tokenizer = AutoTokenizer.from_pretrained(Config.textmodel_dir)
-vocab = tokenizer.get_vocab()
+PAD_ID = 1
+
+def tokenize_questions(questions):
+    tokenized = get_tokenizer()([str(x) for x in questions], return_tensors='np', padding='max_length',
+                          max_length=Config.MAX_LEN_QUES, truncation=True)
+    return tokenized['input_ids'].astype(np.int32), tokenized['attention_mask'].astype(np.int32)
+
+def tokenize_answers(answers):
+    tokenized = get_tokenizer()([str(x) for x in answers], return_tensors='np', padding='max_length',
+                          max_length=Config.MAX_LEN_ANS, truncation=True, return_attention_mask=False)
+    return tokenized['input_ids'].astype(np.int32)
+
+def build_answer_vocab(answers):
+    """
+    Token ids used by the answers, for VQAModel(answer_vocab=...).
+    :return: Sorted int64 array, starting with <s>, <pad>, </s> and <unk> (ids 0-3).
+    """
+    return np.union1d(np.arange(4), tokenize_answers(answers)).astype(np.int64)
+
+def trim_answer_padding(batch):
+    """
+    collate_fn that pads the answers to the longest one in the batch instead of MAX_LEN_ANS.
+    Questions keep their fixed MAX_LEN_QUES padding, the LSTM over PhoBERT runs over the padding too.
+    """
+    batch = list(default_collate(batch))
+    ans_ids = batch[-1]
+    # At least <s> and one target
+    length = max(int((ans_ids != PAD_ID).sum(dim=1).max()), 2)
+    return batch[:-1] + [ans_ids[:, :length]]
+
+def group_images(batch):
+    """
+    collate_fn that stacks each distinct image of the batch once, for batches from ImageGroupedBatchSampler.
+    Samples share an image when the dataset returned the same tensor (see ViTextVQA_Dataset.__getitem__).
+    :return: The usual batch fields, with images holding the distinct images, followed by image_index,
+        the position in images of every question's image.
+    """
+    slots, images, image_index = {}, [], []
+    for sample in batch:
+        image = sample[1]
+        if id(image) not in slots:
+            slots[id(image)] = len(images)
+            images.append(image)
+        image_index.append(slots[id(image)])
+    collated = list(default_collate([sample[:1] + sample[2:] for sample in batch]))
+    return collated[:1] + [torch.stack(images)] + collated[1:] + [torch.tensor(image_index)]
 
 class ViTextVQA_Dataset(Dataset):
-    def __init__(self, dataframe, transform=None):
-        self.data = dataframe
+    def __init__(self, dataframe, img_path=None, transform=None, feature_store=None, pretokenize=False,
+                 image_store=None):
+        try:
+            # Plain column arrays are much cheaper to index than DataFrame.iloc rows
+            self.anno_ids = dataframe['anno_id'].to_numpy()
+            self.images = dataframe['image'].to_numpy()
+            self.questions = dataframe['question'].to_numpy()
+            self.answers = dataframe['answer'].to_numpy()
+        except KeyError as e:
+            raise ValueError(f"Missing expected column: {e}")
+
+        self.img_path = img_path
         self.transform = transform
+        self.feature_store = feature_store
+        self.image_store = image_store
+        self.ques_ids = None
+        self.ques_mask = None
+        self.ans_ids = None
+        # Last image returned, consecutive questions about the same image share its tensor
+        self.last_image = (None, None)
+        if pretokenize:
+            # Tokenize the whole frame once into int32 arrays instead of per sample
+            self.ques_ids, self.ques_mask = tokenize_questions(self.questions)
+            self.ans_ids = tokenize_answers(self.answers)
 
     def __len__(self):
-        return len(self.data)
+        return len(self.anno_ids)
 
     def __getitem__(self, idx):
-        row = self.data.iloc[idx]
+        anno_id = self.anno_ids[idx]
+        image_id = self.images[idx]
+        question = self.questions[idx]
+        answer = self.answers[idx]
 
-        try:
-            anno_id = row['anno_id']
-            image_id = row['image']
-            question = row['question']
-            answer = row['answer']
-        except KeyError as e:
-            raise ValueError(f"Missing expected column: {e}")
+        if self.ans_ids is not None:
+            ques_ids, ques_mask, ans_ids = self.ques_ids[idx], self.ques_mask[idx], self.ans_ids[idx]
+        else:
+            ques_ids, ques_mask = tokenize_questions([question])
+            ques_ids, ques_mask, ans_ids = ques_ids[0], ques_mask[0], tokenize_answers([answer])[0]
+        tokens = torch.from_numpy(ques_ids), torch.from_numpy(ques_mask), torch.from_numpy(ans_ids)
 
+        if self.last_image[0] == image_id:
+            image = self.last_image[1]
+        elif self.feature_store is not None:
+            image = torch.from_numpy(self.feature_store[image_id])
+        elif self.image_store is not None:
+            # Pre-resized uint8 HWC image, laid out like Config.transforms output
+            image = torch.from_numpy(self.image_store[image_id]).permute(2, 0, 1)
+        else:
+            image = self.load_image(image_id)
+        self.last_image = (image_id, image)
 
-        image_path = args.img_path + "/" + image_id
+        return (anno_id, image, question, answer) + tokens
+
+    def answer_lengths(self):
+        """Number of answer tokens of every sample, <s> and </s> included."""
+        ans_ids = self.ans_ids if self.ans_ids is not None else tokenize_answers(self.answers)
+        return (ans_ids != PAD_ID).sum(axis=1)
+
+    def load_image(self, image_id):
+        image_path = self.img_path + "/" + image_id
 
         try:
             image = Image.open(image_path).convert('RGB')
@@ -39,19 +122,55 @@ class ViTextVQA_Dataset(Dataset):
             raise ValueError(f"Image file not found: {image_path}")
         if self.transform:
             image = self.transform(image)
+        return image
 
-        return anno_id, image, question, answer
+def make_dataloader(dataset, args, shuffle=False, sampler=None, batch_sampler=None, collate_fn=None):
+    """
+    :param batch_sampler: Yields the index lists of the batches, replaces batch_size, shuffle and sampler.
+    """
+    num_workers = args.num_workers or 0
+    if batch_sampler is not None:
+        batching = dict(batch_sampler=batch_sampler)
+    else:
+        batching = dict(batch_size=args.batch_size, shuffle=shuffle and sampler is None, sampler=sampler)
+    return DataLoader(dataset, **batching,
+                      collate_fn=collate_fn,
+                      num_workers=num_workers,
+                      pin_memory=torch.cuda.is_available(),
+                      prefetch_factor=args.prefetch_factor if num_workers > 0 else None,
+                      persistent_workers=num_workers > 0)
+
+def make_batched_dataloader(dataset, args, shuffle=False, sampler=None):
+    """
+    DataLoader batched as the command line asks: questions grouped by image (--group_by_image),
+    answers bucketed by length (--bucket_by_length), or make_dataloader with shuffle and sampler.
+    """
+    if args.bucket_by_length and args.group_by_image:
+        raise ValueError("--bucket_by_length and --group_by_image cannot be used together")
+    if args.group_by_image:
+        batch_sampler = ImageGroupedBatchSampler(dataset.images, args.batch_size)
+        return make_dataloader(dataset, args, batch_sampler=batch_sampler, collate_fn=group_images)
+    if args.bucket_by_length:
+        batch_sampler = LengthBucketBatchSampler(dataset.answer_lengths(), args.batch_size,
+                                                 pool_size=args.bucket_pool_size)
+        return make_dataloader(dataset, args, batch_sampler=batch_sampler, collate_fn=trim_answer_padding)
+    return make_dataloader(dataset, args, shuffle=shuffle, sampler=sampler)
 
 if __name__=="__main__":
+    import matplotlib.pyplot as plt
+    from configs.arg_parser import get_args
+    from utils.data_processing import preprocess_data
+
+    args = get_args()
     ### load and processing data
     df_train, _, _ = preprocess_data(args)
-    train_vlsp_dataset = ViTextVQA_Dataset(df_train, transform=Config.transforms)
+    train_vlsp_dataset = ViTextVQA_Dataset(df_train, img_path=args.img_path, transform=Config.transforms)
 
     ### Show example datasets
     random_indices = np.random.choice(len(train_vlsp_dataset), 3)
 
     for idx in random_indices:
-        anno_id, image, question, answer = train_vlsp_dataset[idx]
+        anno_id, image, question, answer, _, _, _ = train_vlsp_dataset[idx]
         
         image = image.permute(1, 2, 0).numpy()
         
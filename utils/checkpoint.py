@@ -0,0 +1,143 @@
+import glob
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+# Frozen DeiT weights, reloaded from the hub when the model is built
+FROZEN_PREFIXES = ('image_model.model.',)
+
+def to_cpu(obj):
+    """Deep copies every tensor of a (nested) state dict to host memory."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+def trainable_state_dict(model):
+    """
+    Host copy of model.state_dict() without the frozen DeiT weights.
+    Tied tensors (the shared PhoBERT embeddings) are copied once and stay shared.
+    """
+    copies = {}
+    state = {}
+    for key, value in model.state_dict().items():
+        if key.startswith(FROZEN_PREFIXES):
+            continue
+        if value.data_ptr() not in copies:
+            copies[value.data_ptr()] = value.detach().to('cpu', copy=True)
+        state[key] = copies[value.data_ptr()]
+    return state
+
+def load_trainable_state_dict(model, state):
+    missing, unexpected = model.load_state_dict(state, strict=False)
+    missing = [key for key in missing if not key.startswith(FROZEN_PREFIXES)]
+    if missing or unexpected:
+        raise ValueError(f"Checkpoint does not match the model, missing: {missing}, unexpected: {unexpected}")
+
+def rng_state():
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def training_state(model, optimizer, scheduler, epoch, batch, step, history, metrics=None):
+    """
+    Snapshot of everything needed to resume training, copied to host memory so it can be
+    serialized while training goes on.
+    :param epoch: Current epoch.
+    :param batch: Number of batches of that epoch already trained on.
+    :param step: Number of optimizer steps so far.
+    :param history: Dict of the loss / metric curves so far.
+    :param metrics: EMF1Accumulator of the current epoch.
+    """
+    return {
+        'model': trainable_state_dict(model),
+        'optimizer': to_cpu(optimizer.state_dict()),
+        'scheduler': scheduler.state_dict(),
+        'rng': rng_state(),
+        'epoch': epoch,
+        'batch': batch,
+        'step': step,
+        'history': {key: list(value) for key, value in history.items()},
+        'metrics': to_cpu(metrics.totals) if metrics is not None else None,
+    }
+
+def restore_training_state(state, model, optimizer, scheduler):
+    load_trainable_state_dict(model, state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scheduler.load_state_dict(state['scheduler'])
+    set_rng_state(state['rng'])
+
+class CheckpointManager:
+    """
+    Writes checkpoints on a background thread and keeps the last few of them.
+    Each file is written to a temporary name and renamed, so a crash never leaves a torn
+    checkpoint behind.
+    :param directory: Directory of the checkpoint_<step>.pt files.
+    :param keep_last: Number of checkpoints kept on disk.
+    """
+
+    def __init__(self, directory, keep_last=3):
+        if keep_last < 1:
+            raise ValueError(f"keep_last must be at least 1, got {keep_last}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keep_last = keep_last
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def checkpoints(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'checkpoint_*.pt')))
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, step, state):
+        """
+        Queues state for writing and returns immediately.
+        :param state: Host-memory snapshot, see training_state.
+        """
+        # At most one write in flight, so snapshots do not pile up in memory
+        self.wait()
+        self.pending = self.executor.submit(self._write, step, state)
+
+    def wait(self):
+        """Blocks until the last queued checkpoint is on disk, re-raising its error if any."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+    def load(self, path=None):
+        path = path or self.latest()
+        if path is None:
+            raise ValueError(f"No checkpoint found in {self.directory}")
+        return torch.load(path, map_location='cpu', weights_only=False)
+
+    def _write(self, step, state):
+        path = os.path.join(self.directory, f'checkpoint_{step:08d}.pt')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            torch.save(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        for old_path in self.checkpoints()[:-self.keep_last]:
+            os.remove(old_path)
+        return path
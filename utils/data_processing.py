@@ -1,26 +1,97 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
 import pandas as pd
-from underthesea import word_tokenize, text_normalize
 
 from configs.arg_parser import get_args
 
-def process_dataframe(df):
-    df['quesion'] = [word_tokenize(text_normalize(x), format='text') for x in df['question']]
-    df['answer'] = [word_tokenize(text_normalize(str(x)), format='text') for x in df['answer']]
+# Part of the cache key with the underthesea version: bump when segment_text changes
+NORMALIZER_VERSION = "2"
+
+def segment_text(text):
+    # underthesea loads its models on import, only pay for it when segmenting
+    from underthesea import word_tokenize, text_normalize
+    return word_tokenize(text_normalize(str(text)), format='text')
+
+def segment_texts(texts, num_workers=None):
+    texts = list(texts)
+    num_workers = num_workers or os.cpu_count()
+    if num_workers <= 1 or len(texts) < 1000:
+        return [segment_text(x) for x in texts]
+    # Several chunks per worker keeps the pool busy when chunks take uneven time
+    chunksize = max(1, len(texts) // (num_workers * 8))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(segment_text, texts, chunksize=chunksize))
+
+def process_dataframe(df, num_workers=None):
+    # Only the answers are segmented, the models read the questions as written
+    df['answer'] = segment_texts(df['answer'], num_workers)
+    return df
+
+def read_annotations(path, columns=None):
+    """
+    Reads an annotation table written by utils/json_to_parquet.py (.parquet, memory-mapped) or a CSV.
+    :param columns: Columns to read, all by default.
+    """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    return pd.read_csv(path, usecols=columns)
+
+def read_annotation_chunks(path, columns=None, chunksize=10000, dtype=None):
+    """
+    Streams an annotation table (see read_annotations) as DataFrames of at most chunksize rows.
+    :param dtype: Column -> dtype, applied while parsing a CSV or after reading a Parquet batch.
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize, columns=columns):
+            chunk = batch.to_pandas()
+            yield chunk.astype(dtype) if dtype else chunk
+    else:
+        yield from pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunksize)
+
+def csv_digest(csv_path):
+    sha = hashlib.sha256(f"{NORMALIZER_VERSION}-underthesea-{version('underthesea')}".encode())
+    with open(csv_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+def load_segmented(csv_path, cache_dir=None, num_workers=None):
+    """
+    Loads a CSV or Parquet annotation file and segments its answers (questions are kept as written,
+    the tokenizer reads them), reusing a Parquet cache.
+    The cache file name holds a hash of the CSV content and NORMALIZER_VERSION,
+    so editing either invalidates it.
+    :param csv_path: Path of the CSV or Parquet file.
+    :param cache_dir: Directory of the cache files, next to the CSV by default.
+    :param num_workers: Processes used for segmentation.
+    :return: Dataframe with segmented answers.
+    """
+    cache_dir = cache_dir or os.path.dirname(os.path.abspath(csv_path))
+    csv_name = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_path = os.path.join(cache_dir, f"{csv_name}.{csv_digest(csv_path)}.segmented.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df = process_dataframe(read_annotations(csv_path), num_workers)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_parquet(cache_path + '.tmp', index=False)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError as e:
+        print(f"Could not write segmentation cache {cache_path}: {e}")
     return df
 
 def preprocess_data(args):
     train_csv_path = args.train_csv_path
     test_csv_path = args.test_csv_path
     dev_csv_path = args.dev_csv_path
-    # Load data
-    df_train = pd.read_csv(train_csv_path)
-    df_dev = pd.read_csv(dev_csv_path)
-    df_test = pd.read_csv(test_csv_path)
-    
-    # Preprocess data
-
-    df_train = process_dataframe(df_train)
-    df_dev = process_dataframe(df_dev)
+    # Load and preprocess data
+    df_train = load_segmented(train_csv_path, args.cache_dir, args.num_workers)
+    df_dev = load_segmented(dev_csv_path, args.cache_dir, args.num_workers)
+    df_test = read_annotations(test_csv_path)
 
     return df_train, df_dev, df_test
 
@@ -28,4 +99,4 @@ if __name__=="__main__":
     args = get_args()
 
     df_train, df_dev, df_test = preprocess_data(args)
-    print(df_train.head())
\ No newline at end of file
+    print(df_train.head())
@@ -0,0 +1,39 @@
+import numpy as np
+
+class TokenDecoder:
+    """
+    Turns predicted token ids into answer strings for a whole batch at once.
+    Tokens after the first </s> are dropped and special tokens are skipped.
+    :param tokenizer: PhoBERT tokenizer providing the vocabulary.
+    :param eos_id: Id of </s>.
+    :param pad_id: Id of <pad>.
+    """
+
+    def __init__(self, tokenizer, eos_id=2, pad_id=1):
+        self.eos_id = eos_id
+        self.pad_id = pad_id
+        vocab = tokenizer.get_vocab()
+        # Array-backed id -> token table, special tokens map to an empty string
+        self.table = np.full(max(vocab.values()) + 1, "", dtype=object)
+        for token, idx in vocab.items():
+            if token not in {"<pad>", "<s>", "</s>"}:
+                self.table[idx] = token
+
+    def truncate(self, ids):
+        # Mask </s> and everything after it with <pad>
+        after_eos = (ids == self.eos_id).cumsum(dim=1) > 0
+        return ids.masked_fill(after_eos, self.pad_id)
+
+    def decode_ids(self, predictions):
+        """
+        :param predictions: Logits (batch, length, vocab) or token ids (batch, length).
+        :return: Truncated token ids on the host, as a numpy array.
+        """
+        ids = predictions.argmax(dim=-1) if predictions.dim() == 3 else predictions
+        # Single device -> host transfer for the whole batch
+        ids = self.truncate(ids).cpu().numpy()
+        return np.where(ids < len(self.table), ids, self.pad_id)
+
+    def decode(self, predictions):
+        tokens = self.table[self.decode_ids(predictions)]
+        return [' '.join(token for token in row if token) for row in tokens]
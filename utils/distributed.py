@@ -0,0 +1,68 @@
+import contextlib
+import os
+import torch
+import torch.distributed as dist
+
+### Data-parallel helpers, all of them also work in a plain single-process run
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+    return get_rank() == 0
+
+def print_main(*args, **kwargs):
+    # Only rank 0 logs, so N processes do not print N copies
+    if is_main_process():
+        print(*args, **kwargs)
+
+def init_distributed(backend='gloo'):
+    """
+    Joins the process group described by the torchrun environment (RANK, WORLD_SIZE, MASTER_ADDR, ...).
+    Does nothing when the script was not started by torchrun.
+    :return: Tuple (rank, world_size).
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return 0, 1
+    if torch.cuda.is_available():
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    else:
+        # Processes on the same machine share its cores instead of each using all of them
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    dist.init_process_group(backend=backend)
+    return get_rank(), get_world_size()
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.barrier()
+        dist.destroy_process_group()
+
+@contextlib.contextmanager
+def main_process_first():
+    """Runs the block on rank 0 before the other ranks, e.g. so only rank 0 writes a shared cache."""
+    if is_distributed() and not is_main_process():
+        dist.barrier()
+    yield
+    if is_distributed() and is_main_process():
+        dist.barrier()
+
+def all_reduce_mean(value):
+    """Average of a Python number over all processes."""
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([float(value)], dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor)
+    return tensor.item() / get_world_size()
+
+def unwrap_model(model):
+    """The VQAModel inside a DistributedDataParallel wrapper."""
+    return model.module if isinstance(model, torch.nn.parallel.DistributedDataParallel) else model
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+### Streams the "annotations" array of ViTextVQA JSON files into Parquet files read by preprocess_data
+
+COLUMNS = ("anno_id", "image", "question", "answer")
+
+class JsonStream:
+    """
+    Incremental reader of one JSON document: values are decoded from a bounded text buffer
+    refilled from the file, so arrays can be walked one element at a time.
+    :param file: Text file object.
+    :param block_size: Characters read per refill.
+    """
+
+    def __init__(self, file, block_size=1 << 20):
+        self.file = file
+        self.block_size = block_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        block = self.file.read(self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        # Drop what has been consumed, the buffer only ever holds the current value
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ('' at the end of the file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == "" or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at character {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut by the end of the buffer may continue in the next block: either it runs
+            # to the end, or it was cut right after "." or an exponent and only its prefix was decoded
+            cut = end == len(self.buffer) or self.buffer[end] in ".eE"
+            if cut and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Walks the array starting at the current position, yielding its elements."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def skip(self):
+        # Arrays are skipped element by element, other values are small enough to decode
+        if self.peek() == "[":
+            for _ in self.items():
+                pass
+        else:
+            self.value()
+
+    def fields(self, key):
+        """Yields the elements of the array stored under key in the top-level object."""
+        self.expect("{")
+        if self.peek() == "}":
+            raise ValueError(f"Missing expected key: {key}")
+        while True:
+            name = self.value()
+            self.expect(":")
+            if name == key:
+                yield from self.items()
+                return
+            self.skip()
+            if self.expect(",}") == "}":
+                raise ValueError(f"Missing expected key: {key}")
+
+def iter_annotations(json_path, block_size=1 << 20):
+    """Rows (anno_id, image, question, answer) of a ViTextVQA annotation file, read incrementally."""
+    with open(json_path, "r", encoding="utf-8") as file:
+        for anno in JsonStream(file, block_size).fields("annotations"):
+            try:
+                yield anno["id"], f"{anno['image_id']}.jpg", anno["question"], ", ".join(anno["answers"])
+            except KeyError as e:
+                raise ValueError(f"Missing expected field {e} in annotation of {json_path}")
+
+def _table(rows, schema):
+    import pyarrow as pa
+    columns = list(zip(*rows)) or [()] * len(COLUMNS)
+    return pa.table({name: list(column) for name, column in zip(COLUMNS, columns)}, schema=schema)
+
+def convert_file(json_path, parquet_path, row_group_size=65536, block_size=1 << 20):
+    """
+    Writes the annotations of one JSON file to Parquet, one row group at a time.
+    :param block_size: Characters read from the JSON file per refill.
+    :return: Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("anno_id", pa.int64()), ("image", pa.string()),
+                        ("question", pa.string()), ("answer", pa.string())])
+    num_rows = 0
+    rows = []
+    tmp_path = parquet_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for row in iter_annotations(json_path, block_size):
+            rows.append(row)
+            if len(rows) == row_group_size:
+                writer.write_table(_table(rows, schema))
+                num_rows += len(rows)
+                rows = []
+        if rows or num_rows == 0:
+            writer.write_table(_table(rows, schema))
+            num_rows += len(rows)
+    os.replace(tmp_path, parquet_path)
+    return num_rows
+
+def _convert(paths):
+    return convert_file(*paths)
+
+def json_to_parquet(input_dir, output_dir, num_workers=None, row_group_size=65536):
+    """
+    Converts every .json file of input_dir to a .parquet file of the same name in output_dir,
+    one file per process.
+    :return: Dict of output path -> number of rows.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(os.path.join(input_dir, name), os.path.join(output_dir, os.path.splitext(name)[0] + ".parquet"),
+             row_group_size)
+            for name in sorted(os.listdir(input_dir)) if name.endswith(".json")]
+    num_workers = min(num_workers or os.cpu_count(), max(len(jobs), 1))
+    if num_workers <= 1:
+        counts = [_convert(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            counts = list(executor.map(_convert, jobs))
+    return {job[1]: count for job, count in zip(jobs, counts)}
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory of ViTextVQA JSON annotation files")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory of the Parquet files")
+    parser.add_argument("--num_workers", type=int, default=None, help="Files converted in parallel (all CPUs by default)")
+    parser.add_argument("--row_group_size", type=int, default=65536, help="Rows held in memory and written per row group")
+    args = parser.parse_args()
+
+    for path, count in json_to_parquet(args.input_dir, args.output_dir, args.num_workers, args.row_group_size).items():
+        print(f"Parquet file '{path}' has been created successfully ({count} rows).")
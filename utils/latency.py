@@ -0,0 +1,43 @@
+import collections
+import math
+import threading
+
+def percentile(values, q):
+    """Nearest-rank percentile of values, q in [0, 100]."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[rank]
+
+class LatencyStats:
+    """
+    Recent request latencies and a histogram of batch sizes, safe to update from several threads.
+    :param window: Number of most recent latencies kept for the percentiles.
+    """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies_ms = collections.deque(maxlen=window)
+        self.batch_sizes = collections.Counter()
+        self.num_requests = 0
+
+    def add_latency(self, latency_ms):
+        with self.lock:
+            self.latencies_ms.append(latency_ms)
+            self.num_requests += 1
+
+    def add_batch(self, batch_size):
+        with self.lock:
+            self.batch_sizes[batch_size] += 1
+
+    def summary(self):
+        with self.lock:
+            latencies = list(self.latencies_ms)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            num_requests = self.num_requests
+        return {
+            "requests": num_requests,
+            "latency_ms": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99)},
+            "batch_sizes": batch_sizes,
+        }
@@ -0,0 +1,59 @@
+import collections
+import sys
+import threading
+import torch
+
+def nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return sys.getsizeof(value)
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+    :param max_bytes: Size limit; least recently used entries are evicted beyond it.
+    :param size_fn: Size of a value in bytes.
+    """
+
+    def __init__(self, max_bytes, size_fn=nbytes):
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.size_fn(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "bytes": self.num_bytes, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+def make_cache(max_mb):
+    # Caches are opt-in: a size of 0 disables them
+    return ByteLRUCache(int(max_mb * 2 ** 20)) if max_mb and max_mb > 0 else None
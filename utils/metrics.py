@@ -1,3 +1,7 @@
+import copy
+import torch
+import torch.nn.functional as F
+
 def normalize_text(text):
         # Lowercase, strip, and normalize spaces
         text = text.lower().strip()
@@ -37,3 +41,106 @@ def compute_em_and_f1(references, hypotheses):
     em_score = total_em / len(references)
     avg_f1_score = total_f1 / len(references)
     return em_score, avg_f1_score
+
+class EMF1Accumulator:
+    """
+    Corpus-level EM and F1 computed on token-id tensors and accumulated across batches.
+    Sequences are cut at the first </s>, and special/padding ids are ignored.
+    F1 is the standard bag-of-tokens F1: repeated ids count as often as they occur in both sequences.
+    :param vocab_size: Upper bound of the token ids.
+    :param ignore_ids: Ids dropped before comparison (<s>, <pad>, </s>).
+    :param eos_id: Id of </s>.
+    :param bag: Count repeated tokens in the F1 overlap, False compares sets of ids like compute_em_and_f1.
+    """
+
+    def __init__(self, vocab_size=64001, ignore_ids=(0, 1, 2), eos_id=2, bag=True):
+        self.vocab_size = vocab_size
+        self.ignore_ids = torch.tensor(ignore_ids)
+        self.eos_id = eos_id
+        self.bag = bag
+        self.reset()
+
+    def reset(self):
+        # Running sums of EM, F1 and the number of pairs, kept on device to avoid syncs
+        self.totals = None
+
+    def _valid(self, ids):
+        after_eos = (ids == self.eos_id).cumsum(dim=1) > 0
+        return ~after_eos & ~torch.isin(ids, self.ignore_ids.to(ids.device))
+
+    def _compact(self, ids, valid, length):
+        # Stable sort moves the kept tokens to the front, in order
+        order = torch.sort((~valid).to(torch.int8), dim=1, stable=True).indices
+        ids = ids.gather(1, order).masked_fill(~valid.gather(1, order), -1)
+        return F.pad(ids, (0, length - ids.size(1)), value=-1)
+
+    def _row_counts(self, ids, valid):
+        rows = torch.arange(ids.size(0), device=ids.device).unsqueeze(1)
+        keys = (rows * self.vocab_size + ids)[valid]
+        return torch.unique(keys, return_counts=True)
+
+    def update(self, predictions, references):
+        """
+        :param predictions: Predicted ids (batch, length) or logits (batch, length, vocab).
+        :param references: Reference ids (batch, length).
+        """
+        pred = predictions.argmax(dim=-1) if predictions.dim() == 3 else predictions
+        pred, ref = pred.long(), references.to(pred.device).long()
+        batch_size = pred.size(0)
+        pred_valid, ref_valid = self._valid(pred), self._valid(ref)
+
+        # Exact match on the compacted sequences
+        length = max(pred.size(1), ref.size(1))
+        em = (self._compact(pred, pred_valid, length) == self._compact(ref, ref_valid, length)).all(dim=1)
+
+        # Overlap of (row, id) keys between predictions and references
+        pred_keys, pred_counts = self._row_counts(pred, pred_valid)
+        ref_keys, ref_counts = self._row_counts(ref, ref_valid)
+        if not self.bag:
+            pred_counts, ref_counts = torch.ones_like(pred_counts), torch.ones_like(ref_counts)
+        if len(ref_keys) > 0:
+            position = torch.searchsorted(ref_keys, pred_keys).clamp(max=len(ref_keys) - 1)
+            match = ref_keys[position] == pred_keys
+            overlap = torch.minimum(pred_counts, ref_counts[position])[match]
+            common = torch.bincount(pred_keys[match] // self.vocab_size, weights=overlap.double(),
+                                    minlength=batch_size)
+        else:
+            common = torch.zeros(batch_size, dtype=torch.float64, device=pred.device)
+        num_pred = torch.bincount(pred_keys // self.vocab_size, weights=pred_counts.double(), minlength=batch_size)
+        num_ref = torch.bincount(ref_keys // self.vocab_size, weights=ref_counts.double(), minlength=batch_size)
+
+        precision = torch.where(num_pred > 0, common / num_pred.clamp(min=1), 0.0)
+        recall = torch.where(num_ref > 0, common / num_ref.clamp(min=1), 0.0)
+        f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall).clamp(min=1e-12), 0.0)
+
+        totals = torch.stack([em.double().sum(), f1.sum(), torch.tensor(batch_size, dtype=torch.float64, device=pred.device)])
+        self.totals = totals if self.totals is None else self.totals + totals
+
+    def all_reduce(self):
+        """Sums the running totals over all processes of the default process group."""
+        import torch.distributed as dist
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        # Every process must join the collective, including one that saw no batch (e.g. after a resume)
+        if self.totals is None:
+            nccl = dist.get_backend() == 'nccl'
+            device = torch.device('cuda', torch.cuda.current_device()) if nccl else torch.device('cpu')
+            self.totals = torch.zeros(3, dtype=torch.float64, device=device)
+        dist.all_reduce(self.totals)
+
+    def reduced(self):
+        """Copy with the totals summed over all processes, this accumulator keeps its local totals."""
+        reduced = copy.copy(self)
+        if self.totals is not None:
+            reduced.totals = self.totals.clone()
+        reduced.all_reduce()
+        return reduced
+
+    def compute(self):
+        """:return: Tuple (em_score, f1_score) over every pair seen since the last reset."""
+        if self.totals is None:
+            return 0.0, 0.0
+        em_sum, f1_sum, count = self.totals.tolist()
+        if count == 0:
+            return 0.0, 0.0
+        return em_sum / count, f1_sum / count
@@ -0,0 +1,69 @@
+import json
+import os
+import numpy as np
+
+class MmapStore:
+    """
+    Fixed-shape arrays stored as rows of a memory-mapped .npy file.
+    Rows are looked up by image filename through ``index.json``.
+    :param path: Directory holding ``data.npy`` and ``index.json``.
+    :param mode: 'r' to read an existing store, 'w' to create a new one.
+    :param keys: Image filenames, one per row (write mode only).
+    :param shape: Shape of a single row (write mode only).
+    :param dtype: Row dtype (write mode only).
+    """
+
+    def __init__(self, path, mode='r', keys=None, shape=None, dtype=np.float16):
+        self.path = path
+        self.mode = mode
+        self.data_path = os.path.join(path, 'data.npy')
+        self.index_path = os.path.join(path, 'index.json')
+        self._data = None
+
+        if mode == 'w':
+            os.makedirs(path, exist_ok=True)
+            self.index = {key: row for row, key in enumerate(keys)}
+            self._data = np.lib.format.open_memmap(self.data_path, mode='w+', dtype=dtype,
+                                                   shape=(len(self.index),) + tuple(shape))
+        else:
+            if not os.path.exists(self.index_path):
+                raise ValueError(f"Store not found or incomplete: {path}")
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                self.index = json.load(file)
+
+    @property
+    def data(self):
+        # Opened lazily so DataLoader workers each map the file themselves
+        if self._data is None:
+            self._data = np.load(self.data_path, mmap_mode='r')
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        try:
+            row = self.index[key]
+        except KeyError:
+            raise ValueError(f"Key not found in store {self.path}: {key}")
+        return np.array(self.data[row])
+
+    def write(self, keys, values):
+        rows = [self.index[key] for key in keys]
+        self.data[rows] = values
+
+    def close(self):
+        """Flush the rows and write the index. The store is only readable after this."""
+        if self.mode == 'w':
+            self._data.flush()
+            with open(self.index_path, 'w', encoding='utf-8') as file:
+                json.dump(self.index, file, ensure_ascii=False)
+        self._data = None
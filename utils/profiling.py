@@ -0,0 +1,102 @@
+import collections
+import contextlib
+import time
+import torch
+
+### Per-stage wall-clock timing and torch.profiler traces for the training and evaluation loops
+
+_DISABLED = contextlib.nullcontext()
+_END = object()
+
+class StageTimer:
+    """
+    Wall-clock time of named stages, summarized as ms per step together with samples/sec.
+    Stages also show up as named ranges in torch.profiler traces.
+    :param enabled: When False, stage() returns a shared no-op context and only samples/sec is tracked.
+    :param sync: Wait for pending CUDA work at stage boundaries, so GPU time is charged to its own stage.
+    """
+
+    def __init__(self, enabled=False, sync=True):
+        self.enabled = enabled
+        self.sync = sync and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        self.totals_ms = collections.defaultdict(float)
+        self.num_steps = 0
+        self.num_samples = 0
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        with torch.profiler.record_function(name):
+            if self.sync:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if self.sync:
+                    torch.cuda.synchronize()
+                self.totals_ms[name] += (time.perf_counter() - start) * 1000
+
+    def iterate(self, iterable, name='data'):
+        """Wraps iterable so each wait for its next item (e.g. a DataLoader batch) is timed as a stage."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(iterable, name)
+
+    def _timed_iter(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def step(self, batch_size):
+        self.num_steps += 1
+        self.num_samples += batch_size
+
+    def summary(self, reset=True):
+        """
+        :param reset: Start a new measurement window.
+        :return: One-line summary of the steps since the last reset.
+        """
+        elapsed = time.perf_counter() - self.start
+        line = f"{self.num_samples / max(elapsed, 1e-9):.2f} samples/sec, {elapsed * 1000 / max(self.num_steps, 1):.1f} ms/step"
+        if self.totals_ms:
+            stages = ", ".join(f"{name} {total / max(self.num_steps, 1):.1f}" for name, total in self.totals_ms.items())
+            line += f" | ms/step: {stages}"
+        if reset:
+            self.reset()
+        return line
+
+class _NullProfiler(contextlib.nullcontext):
+    def __enter__(self):
+        return self
+
+    def step(self):
+        pass
+
+def trace_profiler(trace_dir=None, wait=10, active=5, worker_name=None):
+    """
+    torch.profiler over a window of steps: skips wait steps, warms up for one, then records active
+    steps to a TensorBoard trace in trace_dir. Call step() after every training step.
+    :param trace_dir: Output directory, None returns a profiler that does nothing.
+    """
+    if trace_dir is None:
+        return _NullProfiler()
+    from torch.profiler import ProfilerActivity, profile, schedule, tensorboard_trace_handler
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    return profile(activities=activities, schedule=schedule(wait=wait, warmup=1, active=active, repeat=1),
+                   on_trace_ready=tensorboard_trace_handler(trace_dir, worker_name=worker_name),
+                   record_shapes=True, profile_memory=True)
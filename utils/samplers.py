@@ -0,0 +1,156 @@
+import math
+import numpy as np
+from torch.utils.data import DistributedSampler, Sampler
+from configs.config import Config
+from utils.distributed import get_rank, get_world_size
+
+class ResumableDistributedSampler(DistributedSampler):
+    """
+    DistributedSampler whose shuffled order is fixed by (seed, epoch), so a resumed run can skip
+    the samples it has already trained on. Without a process group it behaves like
+    ``shuffle=True`` over the whole dataset.
+    :param data_source: Dataset to sample from.
+    :param num_replicas: Number of processes, the world size of the process group by default.
+    :param rank: Rank of this process, the rank in the process group by default.
+    :param seed: Base seed of the per-epoch permutation.
+    """
+
+    def __init__(self, data_source, num_replicas=None, rank=None, seed=Config.SEED):
+        num_replicas = get_world_size() if num_replicas is None else num_replicas
+        rank = get_rank() if rank is None else rank
+        super().__init__(data_source, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        """
+        :param epoch: Epoch whose permutation is drawn next.
+        :param start: Number of this process's samples of that permutation to skip.
+        """
+        super().set_epoch(epoch)
+        self.start = start
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        return iter(indices[self.start:])
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+class EpochBatchSampler(Sampler):
+    """
+    Base of the batch samplers whose batches are drawn from (seed, epoch): subclasses build all
+    batches of an epoch in batches(), which are dealt round-robin to the processes. Every process
+    gets the same number of batches, the last ones wrap around to the first.
+    :param num_replicas: Number of processes, the world size of the process group by default.
+    :param rank: Rank of this process, the rank in the process group by default.
+    :param seed: Base seed of the per-epoch order.
+    """
+
+    def __init__(self, num_replicas=None, rank=None, seed=Config.SEED):
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        """
+        :param epoch: Epoch whose order is drawn next.
+        :param start: Number of this process's batches of that order to skip.
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def batches(self):
+        """All batches of the current epoch, as index arrays."""
+        raise NotImplementedError
+
+    def __iter__(self):
+        batches = self.batches()
+        total = math.ceil(len(batches) / self.num_replicas) * self.num_replicas
+        batches += batches[:total - len(batches)]
+        for batch in batches[self.rank:total:self.num_replicas][self.start:]:
+            yield batch.tolist()
+
+    def __len__(self):
+        return math.ceil(len(self.batches()) / self.num_replicas) - self.start
+
+class LengthBucketBatchSampler(EpochBatchSampler):
+    """
+    Batch sampler that puts samples of similar length together, so per-batch padding
+    (see trim_answer_padding) stays short. Each epoch the dataset is shuffled with (seed, epoch),
+    cut into pools of pool_size batches, each pool is sorted by length and split into batches,
+    and the batches are shuffled again.
+    :param lengths: Length of every sample of the dataset.
+    :param batch_size: Samples per batch.
+    :param pool_size: Batches per sorted pool, larger pools pad less but are less random.
+    """
+
+    def __init__(self, lengths, batch_size, pool_size=100, num_replicas=None, rank=None, seed=Config.SEED):
+        if batch_size < 1 or pool_size < 1:
+            raise ValueError(f"batch_size and pool_size must be at least 1, got {batch_size} and {pool_size}")
+        super().__init__(num_replicas=num_replicas, rank=rank, seed=seed)
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+
+    def batches(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        indices = rng.permutation(len(self.lengths))
+        pool = self.batch_size * self.pool_size
+        batches = []
+        for begin in range(0, len(indices), pool):
+            chunk = indices[begin:begin + pool]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+            batches.extend(chunk[i:i + self.batch_size] for i in range(0, len(chunk), self.batch_size))
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def __len__(self):
+        # Same number of batches every epoch, no need to draw them
+        return math.ceil(math.ceil(len(self.lengths) / self.batch_size) / self.num_replicas) - self.start
+
+class ImageGroupedBatchSampler(EpochBatchSampler):
+    """
+    Batch sampler that keeps the questions about one image together, so the image is decoded and
+    encoded once per batch (see group_images). Each epoch the images are shuffled with (seed, epoch)
+    and their questions are packed in that order into batches of up to batch_size questions; an image
+    with more questions than fit in the current batch continues in the next one.
+    :param images: Image name of every sample of the dataset.
+    :param batch_size: Questions per batch.
+    """
+
+    def __init__(self, images, batch_size, num_replicas=None, rank=None, seed=Config.SEED):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+        super().__init__(num_replicas=num_replicas, rank=rank, seed=seed)
+        _, group_ids = np.unique(np.asarray(images), return_inverse=True)
+        # Sample indices sorted by image, and where each image's run of questions starts
+        self.order = np.argsort(group_ids, kind='stable')
+        self.group_starts = np.flatnonzero(np.r_[True, np.diff(group_ids[self.order]) != 0])
+        self.group_ends = np.r_[self.group_starts[1:], len(self.order)]
+        self.batch_size = batch_size
+
+    def batches(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        groups = rng.permutation(len(self.group_starts))
+        indices = np.concatenate([self.order[self.group_starts[g]:self.group_ends[g]] for g in groups])
+        batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def __len__(self):
+        return math.ceil(math.ceil(len(self.order) / self.batch_size) / self.num_replicas) - self.start
+
+def set_loader_epoch(loader, epoch, skip_batches=0):
+    """
+    Sets the epoch of a loader's resumable sampler or batch sampler.
+    :param skip_batches: Number of this process's batches to skip, for resuming mid-epoch.
+    :return: False if the loader's sampler has no set_epoch.
+    """
+    if loader.batch_size is None:
+        sampler, start = loader.batch_sampler, skip_batches
+    else:
+        sampler, start = loader.sampler, skip_batches * loader.batch_size
+    if not hasattr(sampler, 'set_epoch'):
+        return False
+    sampler.set_epoch(epoch, start=start)
+    return True